@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+import argparse
+import sys
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    w = sub.add_parser("worker", help="process queued jobs in separate worker processes")
+    w.add_argument("--processes", type=int, default=1, help="worker processes (default 1)")
+    w.add_argument("--threads", type=int, default=None, help="job threads per process (default ODM_INGEST_WORKERS)")
+    w.add_argument(
+        "--interactive-threads", type=int, default=None,
+        help="extra upload-only threads per process (default ODM_INTERACTIVE_WORKERS)",
+    )
+
+    args = parser.parse_args(argv)
+    if args.command == "worker":
+        from .worker import run
+        run(processes=args.processes, threads=args.threads, interactive_threads=args.interactive_threads)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
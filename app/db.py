@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+from sqlalchemy import inspect
 from sqlmodel import SQLModel, Session, create_engine
 from .settings import settings
 
@@ -10,8 +11,39 @@ def _db_path() -> str:
 
 engine = create_engine(f"sqlite:///{_db_path()}", connect_args={"check_same_thread": False})
 
+def _sql_literal(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def _add_missing_columns() -> None:
+    # create_all() only creates missing tables; columns added to existing
+    # models are appended here so older databases keep working.
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{col.name}" {col.type.compile(engine.dialect)}'
+                if col.default is not None and col.default.is_scalar:
+                    ddl += f" DEFAULT {_sql_literal(col.default.arg)}"
+                conn.exec_driver_sql(ddl)
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
 def init_db() -> None:
+    # registers the tables on SQLModel.metadata, whichever entry point
+    # (web app or standalone worker) gets here first
+    from . import models  # noqa: F401
+
     SQLModel.metadata.create_all(engine)
+    _add_missing_columns()
 
 def get_session() -> Session:
     return Session(engine)
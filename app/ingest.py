@@ -1,102 +1,212 @@
 from __future__ import annotations
 
 import os
+import threading
 import time
-from typing import Set
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
 
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler, FileCreatedEvent, FileMovedEvent
+from watchdog.events import (
+    FileSystemEventHandler, FileClosedEvent, FileCreatedEvent, FileModifiedEvent, FileMovedEvent,
+)
 
 from .settings import settings
-from .processor import process_file
-from .utils import atomic_move, safe_filename, file_stat
-from .db import get_session
-from .models import Document
-
-def _ingest_relative_subdir(path: str) -> str:
-    try:
-        ingest_root = os.path.abspath(settings.ingest_dir)
-        abs_path = os.path.abspath(path)
-        if not abs_path.startswith(ingest_root + os.sep) and abs_path != ingest_root:
-            return ""
-        rel_parent = os.path.relpath(os.path.dirname(abs_path), ingest_root)
-        if rel_parent in (".", ""):
-            return ""
-        return rel_parent
-    except Exception:
-        return ""
+from .jobqueue import enqueue
+from .poller import PollingWatcher, fs_type, is_network_fs
+from .processor import SUPPORTED_EXTS
+from .workqueue import WorkQueue
 
 class _Handler(FileSystemEventHandler):
-    def __init__(self) -> None:
+    # Runs in watchdog's observer thread: only enqueue, never process here.
+    def __init__(self, queue: WorkQueue) -> None:
         super().__init__()
-        self._seen: Set[str] = set()
+        self._queue = queue
+
+    def on_created(self, event):
+        if isinstance(event, FileCreatedEvent):
+            self._queue.put(event.src_path)
+
+    def on_modified(self, event):
+        if isinstance(event, FileModifiedEvent):
+            self._queue.put(event.src_path)
+
+    def on_moved(self, event):
+        # a rename is atomic: the file is complete once it appears
+        if isinstance(event, FileMovedEvent):
+            self._queue.put(event.dest_path, delay=0, settled=True)
+
+    def on_closed(self, event):
+        # IN_CLOSE_WRITE (inotify only): the writer is done with the file
+        if isinstance(event, FileClosedEvent):
+            self._queue.put(event.src_path, delay=0, settled=True)
+
+class _Settle:
+    # Readiness check for platforms/filesystems without close events (and
+    # for files whose close we missed): a non-empty file is ready once its
+    # (size, mtime) has stayed the same between our own checks for
+    # ODM_INGEST_QUIET_SECONDS. The mtime itself is never compared with our
+    # clock: on a network share it comes from the server's clock, and copy
+    # tools may preserve the source's.
+    def __init__(self, quiet: float) -> None:
+        self.quiet = max(0.0, float(quiet))
+        self._last: Dict[str, Tuple[Tuple[int, int], float]] = {}
+        self._lock = threading.Lock()
 
-    def _maybe_process(self, path: str) -> None:
+    def __call__(self, path: str) -> Optional[float]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self._lock:
+                self._last.pop(path, None)
+            return None  # gone; the processor will skip it
+
+        sig = (st.st_size, st.st_mtime_ns)
+        now = time.time()
+        with self._lock:
+            prev_sig, since = self._last.get(path, (None, now))
+            if prev_sig != sig:
+                since = now
+            self._last[path] = (sig, since)
+            stable_for = now - since
+            if st.st_size > 0 and stable_for >= self.quiet:
+                self._last.pop(path, None)
+                return None
+        return max(0.1, self.quiet - stable_for)
+
+class _Dedupe:
+    # Bounded LRU of recently processed keys with TTL expiry. Constant memory
+    # in a long-running container, and a key only blocks reprocessing for
+    # `ttl` seconds.
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = max(0.0, float(ttl))
+        self._items: "OrderedDict[Hashable, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, key: Hashable) -> bool:
+        # True if key was added within the TTL; otherwise records it.
+        now = time.monotonic()
+        with self._lock:
+            added = self._items.get(key)
+            if added is not None and (not self.ttl or now - added < self.ttl):
+                self._items.move_to_end(key)
+                return True
+            self._items[key] = now
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+            return False
+
+    def forget(self, key: Hashable) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+class _Processor:
+    # Hands ready files to the durable job queue (app/jobqueue.py).
+    def __init__(self) -> None:
+        self._seen = _Dedupe(settings.ingest_dedupe_size, settings.ingest_dedupe_ttl_seconds)
+
+    def __call__(self, path: str) -> None:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
         if not os.path.isfile(path):
             return
 
-        norm = os.path.abspath(path)
-        if norm in self._seen:
+        # a new file reusing a name (the scanner's daily scan.pdf) has a
+        # different inode, size or mtime and is processed again
+        key = (os.path.abspath(path), st.st_ino, st.st_size, st.st_mtime_ns)
+        if self._seen.seen(key):
             return
-        self._seen.add(norm)
 
-        # wait for write to settle
-        for _ in range(24):
-            try:
-                size1 = os.path.getsize(path)
-                time.sleep(0.25)
-                size2 = os.path.getsize(path)
-                if size1 == size2 and size2 > 0:
-                    break
-            except FileNotFoundError:
-                return
-
-        job = process_file(path, source="ingest")
-
-        if job.status != "ok":
-            try:
-                if os.path.exists(path):
-                    rel_subdir = _ingest_relative_subdir(path)
-                    failed_dir = os.path.abspath(settings.failed_dir)
-                    dest_dir = os.path.join(failed_dir, rel_subdir) if rel_subdir else failed_dir
-                    base_name = safe_filename(os.path.basename(path))
-                    dest_path = os.path.join(dest_dir, base_name)
-                    moved_to = atomic_move(path, dest_path)
-
-                    size, mtime = file_stat(moved_to)
-                    doc = Document(
-                        location="failed",
-                        abs_path=os.path.abspath(moved_to),
-                        rel_path=os.path.relpath(os.path.abspath(moved_to), os.path.abspath(settings.failed_dir)).replace(os.sep, "/"),
-                        filename=os.path.basename(moved_to),
-                        ext=os.path.splitext(moved_to)[1].lower(),
-                        status=job.status,
-                        template_id=job.template_id,
-                        extracted_company=job.extracted_company or "",
-                        extracted_invoice_number=job.extracted_invoice_number or "",
-                        extracted_date=job.extracted_date or "",
-                        size_bytes=size,
-                        mtime=mtime,
-                    )
-                    # tag it for easy filtering
-                    doc.set_tags(["failed"] if job.status == "failed" else ["unmatched"])
-                    with get_session() as s:
-                        s.add(doc)
-                        s.commit()
-            except Exception:
-                pass
+        try:
+            enqueue(path, source="ingest")
+        except Exception:
+            # e.g. "database is locked": the next event or sweep tries again
+            self._seen.forget(key)
+            raise
 
-    def on_created(self, event):
-        if isinstance(event, FileCreatedEvent):
-            self._maybe_process(event.src_path)
+def _scan_ingest(root: str) -> List[Tuple[float, str]]:
+    # (mtime, path) of every supported file below root; one scandir per
+    # directory, with the stat results scandir already has where possible.
+    found: List[Tuple[float, str]] = []
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            it = os.scandir(d)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTS:
+                        found.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    continue
+    return found
 
-    def on_moved(self, event):
-        if isinstance(event, FileMovedEvent):
-            self._maybe_process(event.dest_path)
+def _ingest_mode(path: str) -> str:
+    # "auto": poll on network filesystems, where inotify sees no changes
+    # made by other hosts (e.g. scanners writing to an SMB share).
+    mode = (settings.ingest_mode or "auto").strip().lower()
+    if mode in ("inotify", "poll"):
+        return mode
+    return "poll" if is_network_fs(path) else "inotify"
 
 class IngestService:
     def __init__(self) -> None:
-        self.observer: Observer | None = None
+        self.observer: Observer | PollingWatcher | None = None
+        self.mode = ""
+        self.queue: WorkQueue | None = None
+        self._stop = threading.Event()
+        self._reconciler: threading.Thread | None = None
+        self.last_reconcile: Dict[str, object] = {}
+
+    def reconcile(self, batch_size: int = 100) -> int:
+        # Picks up files that were there before the watcher started or whose
+        # events were lost (inotify queue overflow). Oldest first, through the
+        # normal queue; paths already queued or in flight are left alone.
+        queue = self.queue
+        if not queue:
+            return 0
+        started = time.time()
+        found = sorted(_scan_ingest(os.path.abspath(settings.ingest_dir)))
+        enqueued = 0
+        for i in range(0, len(found), batch_size):
+            if self._stop.is_set():
+                break
+            for _mtime, path in found[i:i + batch_size]:
+                if queue.contains(path):
+                    continue
+                # blocks while the queue is full
+                if queue.put(path, delay=0):
+                    enqueued += 1
+        self.last_reconcile = {
+            "at": started,
+            "seconds": round(time.time() - started, 2),
+            "found": len(found),
+            "enqueued": enqueued,
+        }
+        return enqueued
+
+    def _reconcile_loop(self) -> None:
+        interval = max(0, int(settings.ingest_reconcile_seconds or 0))
+        while not self._stop.is_set():
+            try:
+                self.reconcile()
+            except Exception:
+                pass
+            if not interval:
+                return
+            self._stop.wait(interval)
 
     def start(self) -> None:
         if not settings.scan_enabled:
@@ -106,15 +216,47 @@ class IngestService:
         os.makedirs(settings.failed_dir, exist_ok=True)
         os.makedirs(settings.tmp_dir, exist_ok=True)
 
-        handler = _Handler()
-        observer = Observer()
-        observer.schedule(handler, settings.ingest_dir, recursive=True)
+        # settling and enqueueing are cheap; processing concurrency is the
+        # job runner's
+        queue = WorkQueue(
+            _Processor(),
+            workers=1,
+            maxsize=settings.ingest_queue_size,
+            debounce=settings.ingest_debounce_seconds,
+            name="papertrellis-ingest",
+            settle=_Settle(settings.ingest_quiet_seconds),
+        )
+        queue.start()
+        self.queue = queue
+
+        self.mode = _ingest_mode(settings.ingest_dir)
+        if self.mode == "poll":
+            observer = PollingWatcher(settings.ingest_dir, queue, interval=settings.ingest_poll_seconds)
+        else:
+            observer = Observer()
+            observer.schedule(_Handler(queue), settings.ingest_dir, recursive=True)
         observer.start()
         self.observer = observer
 
+        # after the observer, so nothing created in between is missed
+        self._stop.clear()
+        t = threading.Thread(target=self._reconcile_loop, daemon=True, name="papertrellis-reconcile")
+        t.start()
+        self._reconciler = t
+
     def stop(self) -> None:
+        self._stop.set()
         if self.observer:
             self.observer.stop()
             self.observer.join(timeout=5)
+        if self.queue:
+            self.queue.stop()
+
+    def stats(self) -> dict:
+        if not self.queue:
+            return {"depth": 0, "maxsize": 0, "workers": 0, "in_flight": [], "reconcile": {}, "mode": "", "poll": {}}
+        poll = self.observer.last_tick if isinstance(self.observer, PollingWatcher) else {}
+        mode = f"{self.mode} ({fs_type(settings.ingest_dir) or 'unknown'})"
+        return dict(self.queue.stats(), reconcile=self.last_reconcile, mode=mode, poll=poll)
 
 ingest_service = IngestService()
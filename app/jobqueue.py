@@ -0,0 +1,373 @@
+from __future__ import annotations
+
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import case, func, update
+from sqlmodel import select
+
+from .db import get_session
+from .models import Job
+from .ocr import page_count
+from .processor import backfill_text, move_to_failed, process_file
+from .settings import settings
+
+# Job.state is the queue lifecycle; Job.status keeps the processing outcome.
+#   queued -> running -> done | failed
+# A failed attempt goes back to queued with exponential backoff, and a
+# running job whose lease expired (its worker died) is queued again.
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Lanes, leased in this order. Within a lane jobs are FIFO, or shortest
+# first with ODM_QUEUE_SJF.
+INTERACTIVE = "interactive"
+INGEST = "ingest"
+BACKGROUND = "background"
+LANES = (INTERACTIVE, INGEST, BACKGROUND)
+
+_MAX_BACKOFF_SECONDS = 3600
+_UNKNOWN_COST = 2 ** 62
+_ORPHAN_UPLOAD_SECONDS = 3600
+
+# Set by enqueue() so idle runners in this process don't wait for the poll
+_wakeup = threading.Event()
+
+def _backoff(attempts: int) -> timedelta:
+    base = max(1, int(settings.job_retry_base_seconds or 1))
+    return timedelta(seconds=min(_MAX_BACKOFF_SECONDS, base * 2 ** max(0, attempts - 1)))
+
+def _sjf_mode() -> str:
+    mode = (settings.queue_sjf or "off").strip().lower()
+    return mode if mode in ("size", "pages") else "off"
+
+def _job_cost(path: str) -> int:
+    mode = _sjf_mode()
+    try:
+        if mode == "size":
+            return os.path.getsize(path)
+        if mode == "pages":
+            return page_count(path)
+    except OSError:
+        pass
+    return 0
+
+def uploads_dir() -> str:
+    # Uploads wait here for their job, so they survive a restart.
+    return os.path.abspath(os.path.join(settings.tmp_dir, "uploads"))
+
+def new_upload_dir() -> str:
+    path = os.path.join(uploads_dir(), uuid.uuid4().hex)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _remove_upload(path: str) -> None:
+    parent = os.path.dirname(os.path.abspath(path))
+    if os.path.dirname(parent) == uploads_dir():
+        shutil.rmtree(parent, ignore_errors=True)
+
+def sweep_uploads() -> int:
+    # Upload dirs without a pending job, left by a crash mid-upload.
+    root = uploads_dir()
+    if not os.path.isdir(root):
+        return 0
+    with get_session() as s:
+        pending = s.exec(
+            select(Job.input_path).where(Job.source == "upload").where(Job.state.in_((QUEUED, RUNNING)))
+        ).all()
+    keep = {os.path.dirname(p) for p in pending}
+    removed = 0
+    now = time.time()
+    for entry in os.scandir(root):
+        try:
+            if entry.path in keep or now - entry.stat().st_mtime < _ORPHAN_UPLOAD_SECONDS:
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(entry.path, ignore_errors=True)
+        removed += 1
+    return removed
+
+def enqueue(path: str, source: str = "ingest", original_name: str = "", lane: str = INGEST) -> Job:
+    # A path that is already queued or running is not queued twice.
+    path = os.path.abspath(path)
+    with get_session() as s:
+        existing = s.exec(
+            select(Job).where(Job.input_path == path).where(Job.state.in_((QUEUED, RUNNING)))
+        ).first()
+        if existing:
+            return existing
+        now = datetime.utcnow()
+        job = Job(
+            source=source,
+            input_path=path,
+            original_name=original_name or os.path.basename(path),
+            status="",
+            state=QUEUED,
+            lane=lane if lane in LANES else INGEST,
+            cost=_job_cost(path),
+            next_attempt_at=now,
+            created_at=now,
+        )
+        s.add(job); s.commit(); s.refresh(job)
+    _wakeup.set()
+    return job
+
+def lease(worker_id: str, lanes: Optional[Sequence[str]] = None) -> Optional[Job]:
+    # Claims the next due job, highest lane first. The UPDATE only succeeds
+    # while the row is still queued, so two workers can't both win it.
+    order = [case(*((Job.lane == lane, i) for i, lane in enumerate(LANES)), else_=len(LANES))]
+    if _sjf_mode() != "off":
+        order.append(case((Job.cost > 0, Job.cost), else_=_UNKNOWN_COST))
+    order += [Job.next_attempt_at, Job.id]
+    with get_session() as s:
+        for _ in range(5):
+            now = datetime.utcnow()
+            stmt = (
+                select(Job.id)
+                .where(Job.state == QUEUED)
+                .where((Job.next_attempt_at == None) | (Job.next_attempt_at <= now))  # noqa: E711
+            )
+            if lanes:
+                stmt = stmt.where(Job.lane.in_(tuple(lanes)))
+            job_id = s.exec(stmt.order_by(*order).limit(1)).first()
+            if job_id is None:
+                return None
+            res = s.exec(
+                update(Job)
+                .where(Job.id == job_id)
+                .where(Job.state == QUEUED)
+                .values(
+                    state=RUNNING,
+                    worker_id=worker_id,
+                    lease_until=now + timedelta(seconds=settings.job_lease_seconds),
+                    attempts=Job.attempts + 1,
+                    started_at=now,
+                    finished_at=None,
+                )
+            )
+            s.commit()
+            if res.rowcount == 1:
+                return s.get(Job, job_id)
+    return None
+
+def heartbeat(worker_id: str, job_ids: List[int]) -> None:
+    if not job_ids:
+        return
+    with get_session() as s:
+        s.exec(
+            update(Job)
+            .where(Job.id.in_(job_ids))
+            .where(Job.worker_id == worker_id)
+            .where(Job.state == RUNNING)
+            .values(lease_until=datetime.utcnow() + timedelta(seconds=settings.job_lease_seconds))
+        )
+        s.commit()
+
+def _transition(job_id: int, worker_id: str, expired_at: Optional[datetime] = None, **values) -> bool:
+    # Only the worker holding the lease (or, with expired_at, anyone once the
+    # lease has run out) may move a running job on.
+    stmt = update(Job).where(Job.id == job_id).where(Job.worker_id == worker_id).where(Job.state == RUNNING)
+    if expired_at is not None:
+        stmt = stmt.where(Job.lease_until < expired_at)
+    with get_session() as s:
+        res = s.exec(stmt.values(**values))
+        s.commit()
+        return res.rowcount == 1
+
+def complete(job_id: int, worker_id: str, state: str = DONE) -> bool:
+    return _transition(job_id, worker_id, state=state, lease_until=None, finished_at=datetime.utcnow())
+
+def retry(job_id: int, worker_id: str, attempts: int) -> bool:
+    return _transition(
+        job_id, worker_id,
+        state=QUEUED, lease_until=None, worker_id="",
+        next_attempt_at=datetime.utcnow() + _backoff(attempts),
+    )
+
+def release(job_id: int, worker_id: str) -> bool:
+    # Checkpoint on shutdown: back to the queue without using up an attempt.
+    return _transition(
+        job_id, worker_id,
+        state=QUEUED, lease_until=None, worker_id="",
+        attempts=Job.attempts - 1, next_attempt_at=datetime.utcnow(),
+    )
+
+def recover() -> int:
+    # Requeues running jobs whose lease expired. A job that keeps killing its
+    # worker ends up failed (and out of the ingest folder) after
+    # ODM_JOB_MAX_ATTEMPTS.
+    now = datetime.utcnow()
+    recovered = 0
+    with get_session() as s:
+        expired = s.exec(
+            select(Job).where(Job.state == RUNNING).where(Job.lease_until < now)
+        ).all()
+    for job in expired:
+        if job.attempts >= settings.job_max_attempts:
+            if not _transition(job.id, job.worker_id, expired_at=now, state=FAILED, lease_until=None,
+                               finished_at=now, status="failed", message="Worker died while processing this file."):
+                continue
+            if job.source == "ingest":
+                job.status = "failed"
+                move_to_failed(job.input_path, job)
+        elif not _transition(job.id, job.worker_id, expired_at=now, state=QUEUED, lease_until=None,
+                             worker_id="", next_attempt_at=now):
+            continue
+        recovered += 1
+    if recovered:
+        _wakeup.set()
+    return recovered
+
+def run_job(job: Job, worker_id: str) -> None:
+    path = job.input_path
+    if job.source == "backfill":
+        status, message = backfill_text(path)
+        _transition(job.id, worker_id, state=DONE if status in ("ok", "skipped") else FAILED,
+                    lease_until=None, finished_at=datetime.utcnow(), status=status, message=message)
+        return
+
+    if not os.path.isfile(path):
+        # finished just before a restart, or removed while queued
+        if job.status == "ok":
+            complete(job.id, worker_id)
+        else:
+            _transition(job.id, worker_id, state=FAILED, lease_until=None, finished_at=datetime.utcnow(),
+                        status="failed", message="Input file no longer exists.")
+        return
+
+    job = process_file(path, source=job.source, job=job)
+    if job.status == "failed" and job.attempts < settings.job_max_attempts:
+        retry(job.id, worker_id, job.attempts)
+        return
+    if job.status != "ok" and job.source == "ingest":
+        move_to_failed(path, job)
+    if job.source == "upload":
+        # unrouted uploads are not kept, as before
+        _remove_upload(path)
+    complete(job.id, worker_id, state=DONE if job.status in ("ok", "skipped") else FAILED)
+
+def stats() -> Dict[str, object]:
+    with get_session() as s:
+        counts = dict(s.exec(select(Job.state, func.count(Job.id)).group_by(Job.state)).all())
+        lanes = dict(
+            s.exec(select(Job.lane, func.count(Job.id)).where(Job.state == QUEUED).group_by(Job.lane)).all()
+        )
+        running = s.exec(
+            select(Job).where(Job.state == RUNNING).order_by(Job.started_at)
+        ).all()
+    now = datetime.utcnow()
+    return {
+        "queued": counts.get(QUEUED, 0),
+        "lanes": {lane: lanes.get(lane, 0) for lane in LANES},
+        "running": [
+            {
+                "path": j.input_path,
+                "lane": j.lane,
+                "worker": j.worker_id,
+                "attempt": j.attempts,
+                "seconds": round((now - j.started_at).total_seconds(), 1) if j.started_at else 0,
+            }
+            for j in running
+        ],
+        "failed": counts.get(FAILED, 0),
+    }
+
+class Runner:
+    # Worker threads draining the job table. A heartbeat thread renews the
+    # leases of this runner's jobs and requeues jobs of dead workers.
+    #
+    # `threads` take jobs from every lane in priority order; the extra
+    # `interactive_threads` only take interactive jobs, so an upload never
+    # waits for a long ingest job to finish.
+
+    def __init__(self, threads: int = 1, interactive_threads: int = 0, name: str = "papertrellis-job") -> None:
+        self.threads = max(1, int(threads))
+        self.interactive_threads = max(0, int(interactive_threads))
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._name = name
+        self._stop = threading.Event()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._running: Dict[int, Job] = {}
+        self._workers: List[threading.Thread] = []
+
+    def _run(self, lanes: Optional[Sequence[str]] = None) -> None:
+        while not self._stop.is_set():
+            _wakeup.clear()
+            try:
+                job = lease(self.worker_id, lanes)
+            except Exception:
+                job = None
+            if job is None:
+                _wakeup.wait(max(0.1, settings.job_poll_seconds))
+                continue
+            with self._lock:
+                self._running[job.id] = job
+            try:
+                run_job(job, self.worker_id)
+            except Exception:
+                pass
+            finally:
+                with self._lock:
+                    self._running.pop(job.id, None)
+
+    def _heartbeat(self) -> None:
+        interval = max(1.0, settings.job_lease_seconds / 3)
+        while not self._done.wait(interval):
+            with self._lock:
+                ids = list(self._running)
+            try:
+                heartbeat(self.worker_id, ids)
+                recover()
+            except Exception:
+                pass
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._done.clear()
+        try:
+            recover()
+            sweep_uploads()
+        except Exception:
+            pass
+        t = threading.Thread(target=self._heartbeat, daemon=True, name=f"{self._name}-heartbeat")
+        t.start()
+        for i in range(self.threads):
+            t = threading.Thread(target=self._run, daemon=True, name=f"{self._name}-{i + 1}")
+            t.start()
+            self._workers.append(t)
+        for i in range(self.interactive_threads):
+            t = threading.Thread(
+                target=self._run, args=((INTERACTIVE,),), daemon=True, name=f"{self._name}-interactive-{i + 1}"
+            )
+            t.start()
+            self._workers.append(t)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        # Drain: no new leases, wait for running jobs, then put whatever is
+        # still running back in the queue for the next start.
+        self._stop.set()
+        _wakeup.set()
+        end = time.monotonic() + (settings.job_drain_seconds if timeout is None else timeout)
+        for t in self._workers:
+            t.join(timeout=max(0.0, end - time.monotonic()))
+        self._workers = []
+        with self._lock:
+            ids = list(self._running)
+        for job_id in ids:
+            try:
+                release(job_id, self.worker_id)
+            except Exception:
+                pass
+        self._done.set()
+
+job_runner = Runner(threads=settings.ingest_workers, interactive_threads=settings.interactive_workers)
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import fcntl
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from .settings import settings
+
+# Coordination between processes sharing the config dir (uvicorn --workers,
+# `python -m app worker`) through flock()ed files. The kernel drops a lock
+# when its process dies, so there is nothing stale to clean up.
+
+def _lock_path(name: str) -> str:
+    os.makedirs(settings.config_dir, exist_ok=True)
+    return os.path.join(settings.config_dir, f"{name}.lock")
+
+@contextmanager
+def file_lock(name: str) -> Iterator[None]:
+    # Blocking exclusive lock, e.g. so only one process migrates the schema.
+    with open(_lock_path(name), "a+") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+class LeaderElection:
+    # Exactly one process holds `name`.lock and runs `on_elected`. The others
+    # retry every `interval` seconds and one of them takes over when the
+    # leader exits or dies.
+
+    def __init__(self, name: str, on_elected: Callable[[], None], interval: float = 5.0) -> None:
+        self.name = name
+        self._on_elected = on_elected
+        self.interval = max(0.5, float(interval))
+        self._file = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._file is not None
+
+    def _try_acquire(self) -> bool:
+        f = open(_lock_path(self.name), "a+")
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        f.seek(0)
+        f.truncate()
+        f.write(f"{socket.gethostname()} {os.getpid()}\n")
+        f.flush()
+        self._file = f
+        return True
+
+    def _elect(self) -> bool:
+        try:
+            if not self._try_acquire():
+                return False
+        except OSError:
+            return False
+        try:
+            self._on_elected()
+        except Exception:
+            pass
+        return True
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            if self._elect():
+                return
+
+    def start(self) -> None:
+        self._stop.clear()
+        # first attempt inline so a single process is leader before startup ends
+        if self._elect():
+            return
+        t = threading.Thread(target=self._loop, daemon=True, name=f"papertrellis-{self.name}")
+        t.start()
+        self._thread = t
+
+    def stop(self) -> None:
+        self._stop.set()
+        f, self._file = self._file, None
+        if f is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            finally:
+                f.close()
+
+    def holder(self) -> str:
+        # "host pid" of the current leader, as written when it was elected
+        try:
+            with open(_lock_path(self.name)) as f:
+                return f.read().strip()
+        except OSError:
+            return ""
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import os
 import json
+import shutil
 from datetime import datetime
 from typing import Optional, List
 
@@ -9,6 +10,7 @@ from fastapi import FastAPI, Request, UploadFile, File, Form
 from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
+from sqlalchemy import case, func
 from sqlmodel import select
 
 from .version import __version__
@@ -20,9 +22,12 @@ from .seed import seed_defaults
 from .library_scan import scan_library_dirs
 from .indexer import start_indexer_thread
 from .ingest import ingest_service
-from .processor import process_file
-from .ocr import get_text
-from .templating import evaluate_template, extract_fields
+from .leader import LeaderElection, file_lock
+from .ocr import get_text, ocr_timings, preprocess_steps, shutdown_pool
+from . import jobqueue, ocr_cache, scratch, template_registry
+from .regex_guard import lint_pattern
+from .profiler import profile_templates
+from .templating import compile_template, extract_fields, format_path_and_name
 
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 
@@ -66,6 +71,13 @@ def _safe_resolve_doc_path(doc: Document) -> str:
         raise ValueError("Invalid path")
     return abs_path
 
+def _on_elected() -> None:
+    start_indexer_thread()
+    ingest_service.start()
+
+# With several web processes only one indexes and watches the ingest folder.
+leader = LeaderElection("leader", _on_elected, interval=settings.leader_poll_seconds)
+
 @app.on_event("startup")
 def _startup():
     os.makedirs(settings.config_dir, exist_ok=True)
@@ -73,11 +85,14 @@ def _startup():
     os.makedirs(settings.ingest_dir, exist_ok=True)
     os.makedirs(settings.failed_dir, exist_ok=True)
     os.makedirs(settings.tmp_dir, exist_ok=True)
+    scratch.sweep()
 
-    init_db()
-    seed_defaults()
-    start_indexer_thread()
-    ingest_service.start()
+    with file_lock("schema"):
+        init_db()
+        seed_defaults()
+    leader.start()
+    if settings.background_processing:
+        jobqueue.job_runner.start()
 
 @app.get("/", response_class=HTMLResponse)
 def home(request: Request):
@@ -242,14 +257,7 @@ def analyze_doc(request: Request, doc_id: int):
         doc.ocr_text = (text or "")[:200000]
 
         # try matching templates
-        templates = s.exec(select(Template).where(Template.enabled == True)).all()  # noqa: E712
-        best = None
-        best_score = -1
-        for tpl in templates:
-            ok, score = evaluate_template(tpl, doc.ocr_text)
-            if ok and score >= best_score:
-                best = tpl
-                best_score = score
+        best = template_registry.choose(doc.ocr_text)
 
         if best:
             ex = extract_fields(best, doc.ocr_text)
@@ -259,8 +267,8 @@ def analyze_doc(request: Request, doc_id: int):
             doc.extracted_date = ex.date.isoformat() if ex.date else ""
             # keep existing tags, but add template tags
             tags = set(doc.tags())
-            tags.add((best.doc_type or "document").lower().replace(" ", "-"))
-            for t in best.tags():
+            tags.add((best.template.doc_type or "document").lower().replace(" ", "-"))
+            for t in best.template.tags():
                 tags.add(t.lower().replace(" ", "-"))
             if ex.company:
                 tags.add(ex.company.lower().replace(" ", "-"))
@@ -274,7 +282,7 @@ def analyze_doc(request: Request, doc_id: int):
 
 # --- Upload ---
 @app.post("/upload")
-async def upload(request: Request, file: UploadFile = File(...)):
+def upload(request: Request, file: UploadFile = File(...)):
     r = require_login_or_redirect(request)
     if r:
         return r
@@ -282,14 +290,14 @@ async def upload(request: Request, file: UploadFile = File(...)):
     if not file.filename:
         return RedirectResponse("/documents", status_code=303)
 
-    os.makedirs(settings.tmp_dir, exist_ok=True)
-    tmp_path = os.path.join(settings.tmp_dir, f"upload_{datetime.utcnow().timestamp()}_{os.path.basename(file.filename)}")
-
+    # Saved where it survives a restart and processed on the interactive
+    # lane, ahead of any ingest backlog; the request returns right away.
+    # the generated prefix keeps names like ".." or "" usable
+    upload_dir = jobqueue.new_upload_dir()
+    tmp_path = os.path.join(upload_dir, f"upload_{datetime.utcnow().timestamp()}_{os.path.basename(file.filename)}")
     with open(tmp_path, "wb") as f:
-        f.write(await file.read())
-
-    # process as upload (goes to library if matches template)
-    process_file(tmp_path, source="upload")
+        shutil.copyfileobj(file.file, f, 1024 * 1024)
+    jobqueue.enqueue(tmp_path, source="upload", lane=jobqueue.INTERACTIVE)
     return RedirectResponse("/documents", status_code=303)
 
 # --- Tags ---
@@ -337,6 +345,59 @@ def template_new(request: Request):
     library_dirs = scan_library_dirs(settings.library_dir, max_depth=6)
     return render(request, "template_edit.html", tpl=None, library_dirs=library_dirs, error="")
 
+def _render_templates_test(request: Request, **ctx) -> HTMLResponse:
+    with get_session() as s:
+        templates = s.exec(select(Template).order_by(Template.name.asc())).all()
+    ctx.setdefault("template_id", "")
+    ctx.setdefault("text", "")
+    ctx.setdefault("result", None)
+    ctx.setdefault("profile", None)
+    ctx.setdefault("sample", 200)
+    return render(request, "templates_test.html", templates=templates, **ctx)
+
+@app.get("/templates/test", response_class=HTMLResponse)
+def templates_test(request: Request):
+    r = require_login_or_redirect(request)
+    if r:
+        return r
+    return _render_templates_test(request)
+
+@app.post("/templates/test", response_class=HTMLResponse)
+def templates_test_run(request: Request, template_id: str = Form(default=""), text: str = Form(default="")):
+    r = require_login_or_redirect(request)
+    if r:
+        return r
+
+    ct = None
+    if template_id.strip().isdigit():
+        with get_session() as s:
+            tpl = s.get(Template, int(template_id))
+        ct = compile_template(tpl) if tpl else None
+    else:
+        ct = template_registry.choose(text)
+
+    result = {"template_name": "(no match)", "company": "", "invoice_number": "", "date": "", "out_rel": "", "filename": ""}
+    if ct:
+        extracted = extract_fields(ct, text)
+        out_rel, fname = format_path_and_name(ct, extracted, "original", ".pdf")
+        result = {
+            "template_name": ct.name,
+            "company": extracted.company,
+            "invoice_number": extracted.invoice_number,
+            "date": extracted.date.isoformat() if extracted.date else "",
+            "out_rel": out_rel,
+            "filename": fname + ".pdf",
+        }
+    return _render_templates_test(request, template_id=template_id, text=text, result=result)
+
+@app.post("/templates/profile", response_class=HTMLResponse)
+def templates_profile(request: Request, sample: int = Form(default=200)):
+    r = require_login_or_redirect(request)
+    if r:
+        return r
+    sample = max(1, min(int(sample or 200), 2000))
+    return _render_templates_test(request, profile=profile_templates(sample), sample=sample)
+
 @app.get("/templates/{tpl_id}", response_class=HTMLResponse)
 def template_edit(request: Request, tpl_id: int):
     r = require_login_or_redirect(request)
@@ -400,9 +461,24 @@ def template_save(
         tpl.output_path_template = output_path_template.strip() or "{doc_folder}"
         tpl.filename_template = filename_template.strip() or "{original_name}"
 
+        # reject regexes that could stall matching; the form keeps its input
+        problems = []
+        for field, pattern in sorted(tpl.regex_fields()):
+            msg = lint_pattern(pattern)
+            if msg:
+                problems.append({"field": field, "pattern": pattern, "message": msg})
+        if problems:
+            library_dirs = scan_library_dirs(settings.library_dir, max_depth=6)
+            return render(
+                request, "template_edit.html", tpl=tpl, library_dirs=library_dirs,
+                error="Template not saved: fix the patterns below.", problems=problems,
+            )
+
+        tpl.prune_warnings()
         s.add(tpl)
         s.commit()
         s.refresh(tpl)
+    template_registry.bump()
 
     return RedirectResponse("/templates", status_code=303)
 
@@ -417,9 +493,24 @@ def template_delete(request: Request, tpl_id: int):
         if tpl:
             s.delete(tpl)
             s.commit()
+    template_registry.bump()
     return RedirectResponse("/templates", status_code=303)
 
 # --- Ingest / Failed ---
+def _ocr_quality_by_dpi() -> List[dict]:
+    with get_session() as s:
+        rows = s.exec(
+            select(
+                Job.ocr_dpi,
+                func.count(Job.id),
+                func.avg(case((Job.ocr_confidence >= 0, Job.ocr_confidence), else_=None)),
+            )
+            .where(Job.ocr_dpi > 0)
+            .group_by(Job.ocr_dpi)
+            .order_by(Job.ocr_dpi)
+        ).all()
+    return [{"dpi": dpi, "jobs": n, "confidence": conf} for dpi, n, conf in rows]
+
 @app.get("/ingest", response_class=HTMLResponse)
 def ingest_page(request: Request):
     r = require_login_or_redirect(request)
@@ -433,7 +524,19 @@ def ingest_page(request: Request):
         failed_dir=settings.failed_dir,
         scan_enabled=settings.scan_enabled,
         scan_interval=settings.scan_interval_seconds,
-        tesseract_lang=settings.tesseract_lang
+        tesseract_lang=settings.tesseract_lang,
+        ocr_cache_enabled=settings.ocr_cache_enabled,
+        ocr_cache=ocr_cache.stats(),
+        ocr_quality=_ocr_quality_by_dpi(),
+        ocr_adaptive_dpi=settings.ocr_adaptive_dpi,
+        ocr_timings=ocr_timings(),
+        ocr_preprocess=", ".join(preprocess_steps()) or "none",
+        scratch=scratch.usage(),
+        ingest_queue=ingest_service.stats(),
+        jobs=jobqueue.stats(),
+        leader=leader.is_leader,
+        leader_holder=leader.holder(),
+        ocr_render_mode=settings.ocr_render_mode,
     )
 
 @app.get("/failed", response_class=HTMLResponse)
@@ -447,3 +550,15 @@ def _shutdown():
         ingest_service.stop()
     except Exception:
         pass
+    try:
+        leader.stop()
+    except Exception:
+        pass
+    try:
+        jobqueue.job_runner.stop()
+    except Exception:
+        pass
+    try:
+        shutdown_pool()
+    except Exception:
+        pass
@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import re
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+try:
+    from re import _casefix, _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11: no re._casefix, see required_literals()
+    import sre_constants
+    import sre_parse
+    _casefix = None
+
+from .regex_guard import GuardedPattern
+from .templating import CompiledTemplate
+
+# Template matching that scans the OCR text once.
+#
+# Each match pattern is reduced to requirements: sets of literal strings,
+# and any text the pattern can match contains at least one literal of every
+# set. One regex built from a trie of all literals finds which of them
+# occur, and a pattern's regex only runs if all its requirements are met.
+# Patterns without a usable literal always run, and a pattern shared by
+# several templates runs once per text. A pattern that fails the prefilter
+# cannot match, so ok/score are exactly those of evaluate_template().
+
+_MIN_LITERAL = 3
+
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+if hasattr(sre_constants, "POSSESSIVE_REPEAT"):
+    _REPEATS.add(sre_constants.POSSESSIVE_REPEAT)
+_ATOMIC = getattr(sre_constants, "ATOMIC_GROUP", None)
+# zero-width: consumed text on either side stays contiguous
+_ZERO_WIDTH = {sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT}
+
+# --- case folding matching re.IGNORECASE ---
+# re compares characters by their simple lowercase mapping plus a few extra
+# equivalences (re._casefix, e.g. "s" and long s). str.lower() agrees with
+# the simple mapping except for U+0130 and the final-sigma rule, and the
+# extra classes are collapsed onto their smallest member.
+
+def _extra_fold() -> Dict[int, int]:
+    table: Dict[int, int] = {}
+    if _casefix is None:
+        return table
+    for lo, others in _casefix._EXTRA_CASES.items():
+        canon = min((lo,) + tuple(others))
+        for cp in (lo,) + tuple(others):
+            if cp != canon:
+                table[cp] = canon
+    return table
+
+_EXTRA_FOLD = _extra_fold()
+
+def fold(s: str) -> str:
+    if s.isascii():
+        return s.lower()
+    return s.replace("İ", "i").lower().translate(_EXTRA_FOLD)
+
+# --- literal extraction ---
+
+Requirement = FrozenSet[str]
+
+def _usable(factors: List[Requirement]) -> Tuple[Requirement, ...]:
+    return tuple(dict.fromkeys(f for f in factors if f and min(len(x) for x in f) >= _MIN_LITERAL))
+
+def _best(factors: List[Requirement]) -> Optional[Requirement]:
+    usable = _usable(factors)
+    if not usable:
+        return None
+    # the most selective guess: longest shortest-alternative, then fewest
+    return max(usable, key=lambda f: (min(len(x) for x in f), -len(f)))
+
+def _factors(items) -> List[Requirement]:
+    # Requirements that every match of the sequence `items` satisfies.
+    factors: List[Requirement] = []
+    run: List[str] = []
+
+    def flush() -> None:
+        if run:
+            factors.append(frozenset([fold("".join(run))]))
+            run.clear()
+
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            run.append(chr(av))
+        elif op in _ZERO_WIDTH:
+            continue
+        elif op is sre_constants.SUBPATTERN or op is _ATOMIC:
+            sub = av[-1] if op is sre_constants.SUBPATTERN else av
+            if all(o is sre_constants.LITERAL for o, _ in sub):
+                run.extend(chr(a) for _, a in sub)
+                continue
+            flush()
+            factors.extend(_factors(sub))
+        elif op in _REPEATS:
+            flush()
+            lo, _hi, sub = av
+            if lo >= 1:
+                factors.extend(_factors(sub))
+        elif op is sre_constants.BRANCH:
+            flush()
+            alts = [_best(_factors(alt)) for alt in av[1]]
+            if alts and all(alts):
+                factors.append(frozenset().union(*alts))
+        else:
+            flush()
+    flush()
+    return factors
+
+def required_literals(pattern: str, flags: int = re.IGNORECASE | re.MULTILINE) -> Tuple[Requirement, ...]:
+    # Sets of folded literals; every match contains one literal of each set.
+    if flags & re.IGNORECASE and _casefix is None:
+        # without re's extra case equivalences fold() could disagree with
+        # re, so case-insensitive patterns always run
+        return ()
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return ()
+    return _usable(_factors(parsed))
+
+# --- scanning ---
+
+def _trie_regex(words: Iterable[str]) -> str:
+    trie: Dict[str, dict] = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        if "" in node:
+            # greedy: the longest literal at a position wins
+            return "(?:" + "|".join(alts) + ")?"
+        return alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+
+    return build(trie)
+
+class TemplateMatcher:
+    def __init__(self, templates: List[CompiledTemplate]) -> None:
+        self.templates = templates
+        # per template: (pattern, requirements) pairs; None pattern = invalid or disabled
+        self._plans: List[List[Tuple[Optional[GuardedPattern], Tuple[Requirement, ...]]]] = []
+        literals: Set[str] = set()
+        reqs: Dict[GuardedPattern, Tuple[Requirement, ...]] = {}
+        for ct in templates:
+            plan = []
+            for p in ct.patterns:
+                if p is not None and p not in reqs:
+                    reqs[p] = required_literals(p.pattern, p.flags)
+                    for req in reqs[p]:
+                        literals |= req
+                plan.append((p, reqs.get(p, ()) if p is not None else ()))
+            self._plans.append(plan)
+
+        self._scanner: Optional[re.Pattern] = None
+        self._implied: Dict[str, Tuple[str, ...]] = {}
+        if literals:
+            # lookahead: a match at every position, even inside another one
+            self._scanner = re.compile("(?=(" + _trie_regex(literals) + "))", re.DOTALL)
+            for lit in literals:
+                self._implied[lit] = tuple(
+                    lit[:k] for k in range(_MIN_LITERAL, len(lit) + 1) if lit[:k] in literals
+                )
+
+    def literals_in(self, text: str) -> Set[str]:
+        found: Set[str] = set()
+        if self._scanner is None:
+            return found
+        longest = {m.group(1) for m in self._scanner.finditer(fold(text))}
+        for lit in longest:
+            found.update(self._implied.get(lit, ()))
+        return found
+
+    def evaluate(self, text: str) -> List[Tuple[CompiledTemplate, bool, int]]:
+        # (template, ok, hits) as evaluate_template() gives them. For an "all"
+        # template that can't match, hits is a lower bound.
+        found = self.literals_in(text)
+        # patterns compare equal by pattern and flags
+        searched: Dict[GuardedPattern, bool] = {}
+        out = []
+        for ct, plan in zip(self.templates, self._plans):
+            if not plan:
+                out.append((ct, False, 0))
+                continue
+            need_all = ct.match_mode != "any"
+            hits = 0
+            for p, reqs in plan:
+                if p is None or not all(not req.isdisjoint(found) for req in reqs):
+                    hit = False
+                else:
+                    hit = searched.get(p)
+                    if hit is None:
+                        hit = searched[p] = p.search(text) is not None
+                if hit:
+                    hits += 1
+                elif need_all:
+                    break
+            ok = hits == len(plan) if need_all else hits > 0
+            out.append((ct, ok, hits))
+        return out
+
+    def choose(self, text: str) -> Optional[CompiledTemplate]:
+        # Best-scoring matching template; on a tie the later one wins.
+        best = None
+        best_score = -1
+        for ct, ok, score in self.evaluate(text):
+            if ok and score >= best_score:
+                best = ct
+                best_score = score
+        return best
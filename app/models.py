@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Set, Tuple
 
 from sqlmodel import SQLModel, Field
 import json
@@ -27,6 +27,9 @@ class Template(SQLModel, table=True):
     output_path_template: str = "{doc_folder}/{company}/{date:%Y}"
     filename_template: str = "{company}_{invoice_number}_{date:%Y-%m-%d}"
 
+    # Patterns disabled by the regex guard: [{field, pattern, message, at}]
+    warnings_json: str = "[]"
+
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
     def tags(self) -> List[str]:
@@ -51,13 +54,41 @@ class Template(SQLModel, table=True):
         patterns = [p.strip() for p in (patterns or []) if p and p.strip()]
         self.match_patterns_json = json.dumps(patterns)
 
+    def regex_fields(self) -> Set[Tuple[str, str]]:
+        # (field, pattern) for every regex; match patterns use field "match"
+        out = {("match", p) for p in self.match_patterns()}
+        for f in ("company_regex", "invoice_number_regex", "date_regex"):
+            if getattr(self, f):
+                out.add((f, getattr(self, f)))
+        return out
+
+    def warnings(self) -> List[dict]:
+        try:
+            arr = json.loads(self.warnings_json or "[]")
+            return [w for w in arr if isinstance(w, dict) and w.get("pattern")]
+        except Exception:
+            return []
+
+    def disabled_patterns(self) -> Set[Tuple[str, str]]:
+        return {(w.get("field", ""), w["pattern"]) for w in self.warnings()}
+
+    def add_warning(self, field: str, pattern: str, message: str) -> None:
+        arr = [w for w in self.warnings() if (w.get("field"), w["pattern"]) != (field, pattern)]
+        arr.append({"field": field, "pattern": pattern, "message": message, "at": datetime.utcnow().isoformat(timespec="seconds")})
+        self.warnings_json = json.dumps(arr)
+
+    def prune_warnings(self) -> None:
+        # An edited pattern is enabled again; unchanged ones stay disabled.
+        current = self.regex_fields()
+        self.warnings_json = json.dumps([w for w in self.warnings() if (w.get("field"), w["pattern"]) in current])
+
 class Job(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
 
-    source: str = "ingest"  # ingest|upload
+    source: str = "ingest"  # ingest|upload|backfill
     input_path: str = ""
     original_name: str = ""
-    status: str = "failed"  # ok|failed|skipped
+    status: str = "failed"  # ok|failed|skipped|timeout
     message: str = ""
     template_id: Optional[int] = None
     dest_path: str = ""
@@ -66,6 +97,22 @@ class Job(SQLModel, table=True):
     extracted_invoice_number: str = ""
     extracted_date: str = ""  # ISO
 
+    ocr_dpi: int = 0  # 0 = no rasterized OCR
+    ocr_confidence: float = -1.0  # mean word confidence, -1 = unknown
+    ocr_preprocess_ms: int = 0
+    ocr_ms: int = 0
+
+    # Durable queue (app/jobqueue.py). Jobs processed inline are created "done".
+    state: str = Field(default="done", index=True)  # queued|running|done|failed
+    lane: str = "ingest"  # interactive|ingest|background
+    cost: int = 0  # bytes or pages for shortest-job-first, 0 = unknown
+    attempts: int = 0
+    next_attempt_at: Optional[datetime] = None
+    lease_until: Optional[datetime] = None
+    worker_id: str = ""
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Document(SQLModel, table=True):
@@ -76,7 +123,7 @@ class Document(SQLModel, table=True):
     rel_path: str
     filename: str
     ext: str = ""
-    status: str = "indexed"  # indexed|ok|failed|skipped
+    status: str = "indexed"  # indexed|ok|failed|skipped|timeout
 
     tags_json: str = "[]"
     template_id: Optional[int] = None
@@ -102,3 +149,17 @@ class Document(SQLModel, table=True):
     def set_tags(self, tags: List[str]) -> None:
         tags = [t.strip() for t in (tags or []) if t and t.strip()]
         self.tags_json = json.dumps(sorted(set(tags), key=str.lower))
+
+class OcrCacheEntry(SQLModel, table=True):
+    # sha256 of the file bytes + OCR settings fingerprint
+    key: str = Field(primary_key=True)
+
+    text: str = ""
+    method: str = ""
+    dpi: int = 0
+    confidence: float = -1.0
+    size_bytes: int = 0
+    hits: int = 0
+
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_used_at: datetime = Field(default_factory=datetime.utcnow, index=True)
@@ -1,39 +1,865 @@
 from __future__ import annotations
 
+import functools
+import multiprocessing
 import os
-from typing import Tuple
+import queue
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
-from pdfminer.high_level import extract_text as pdf_extract_text
-from pdf2image import convert_from_path
-from PIL import Image
+import pdfminer
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LTContainer, LTText, LTTextBox
+from pdf2image import convert_from_path, pdfinfo_from_path
+from pdf2image.exceptions import PDFPopplerTimeoutError
+from PIL import Image, ImageOps, ImageSequence
 import pytesseract
 
+from . import ocr_cache, scratch
 from .settings import settings
 
+# Pages with fewer non-space characters than this are treated as scanned.
+MIN_PAGE_TEXT_CHARS = 30
+
+# Bump when a change to the extraction pipeline changes its output.
+_EXTRACT_VERSION = 5
+
+PREPROCESS_STEPS = ("autorotate", "downscale", "grayscale", "deskew", "binarize")
+
+# Long side of an A4 page; "downscale" caps images at ODM_OCR_TARGET_DPI for it.
+_PAGE_LONG_SIDE_INCHES = 11.69
+
+# Deskew searches +/- this many degrees in 0.5 degree steps.
+_MAX_SKEW_DEGREES = 5
+
+# Extra time a pool task gets beyond its budget, so tesseract/pdftoppm can be
+# stopped by their own timeouts before the worker process is killed.
+_KILL_GRACE_SECONDS = 5
+
+class OcrTimeout(RuntimeError):
+    def __init__(self, stage: str, budget: str = "page") -> None:
+        super().__init__(stage, budget)
+        self.stage = stage
+        self.budget = budget
+
+    def __str__(self) -> str:
+        return f"Timed out during {self.stage} ({self.budget} budget exceeded)"
+
+class Deadline:
+    # Wall-clock budgets for one extraction: per page (ODM_OCR_PAGE_TIMEOUT_SECONDS)
+    # and per document (ODM_OCR_JOB_TIMEOUT_SECONDS). 0 disables either.
+    def __init__(self, job_seconds: Optional[float] = None, page_seconds: Optional[float] = None) -> None:
+        self.started = time.monotonic()
+        self.job_seconds = float(settings.ocr_job_timeout_seconds if job_seconds is None else job_seconds)
+        self.page_seconds = float(settings.ocr_page_timeout_seconds if page_seconds is None else page_seconds)
+
+    @property
+    def enabled(self) -> bool:
+        return self.job_seconds > 0 or self.page_seconds > 0
+
+    def budget(self, stage: str, pages: int = 1) -> Optional[float]:
+        # Seconds `stage` may take for `pages` pages; raises once the document
+        # budget is spent.
+        limits: List[float] = []
+        if self.page_seconds > 0:
+            limits.append(self.page_seconds * max(1, pages))
+        if self.job_seconds > 0:
+            remaining = self.job_seconds - (time.monotonic() - self.started)
+            if remaining <= 0:
+                raise OcrTimeout(stage, "document")
+            limits.append(remaining)
+        return min(limits) if limits else None
+
+    def kind(self, stage: str, pages: int = 1) -> str:
+        # Which budget a timeout in `stage` ran into.
+        if self.job_seconds > 0 and self.page_seconds > 0:
+            remaining = self.job_seconds - (time.monotonic() - self.started)
+            return "document" if remaining <= self.page_seconds * max(1, pages) else "page"
+        return "document" if self.job_seconds > 0 else "page"
+
+@dataclass
+class OcrResult:
+    text: str
+    method: str
+    pages: int = 0
+    # False when only the first pages were extracted (see extract(max_pages=...))
+    complete: bool = True
+    # Highest DPI any page was finally OCR'd at (0 = no rasterized OCR)
+    dpi: int = 0
+    # Mean Tesseract word confidence over OCR'd pages (-1 = unknown)
+    confidence: float = -1.0
+    # Summed per-page worker time
+    preprocess_ms: int = 0
+    ocr_ms: int = 0
+    # Pages (1-based) rasterized and OCR'd by this extraction; a later full
+    # extraction at the same DPI can reuse them (see extract(reuse=...))
+    ocr_pages: Dict[int, "PageText"] = field(default_factory=dict)
+
+@dataclass(frozen=True)
+class OcrOptions:
+    lang: str
+    backend: str
+    confidence: bool = False
+    preprocess: Tuple[str, ...] = ()
+    target_dpi: int = 300
+    # per-page budget counted from the start of the page, 0 = none
+    timeout: float = 0
+
+@dataclass
+class PageText:
+    text: str
+    confidence: float = -1.0
+    preprocess_s: float = 0.0
+    ocr_s: float = 0.0
+
+_timings: Dict[str, float] = {"pages": 0, "preprocess_s": 0.0, "ocr_s": 0.0}
+_timings_lock = threading.Lock()
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def ocr_workers() -> int:
+    n = int(settings.ocr_workers or 0)
+    if n <= 0:
+        n = os.cpu_count() or 1
+    return max(1, n)
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the web process is multi-threaded
+            _pool = ProcessPoolExecutor(
+                max_workers=ocr_workers(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+def _discard_pool(pool: ProcessPoolExecutor, kill: bool = False) -> None:
+    # Drop `pool` (only if it is still the current one) so the next use
+    # creates a new pool. kill=True also kills its workers: runaway tasks
+    # can't be cancelled. Jobs with futures in it see a broken or cancelled
+    # pool and retry once on the new one.
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    if kill:
+        for proc in list((getattr(pool, "_processes", None) or {}).values()):
+            try:
+                proc.kill()
+            except Exception:
+                pass
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _budgeted(fn, args: tuple, budget: Optional[float], stage: str, kind: str):
+    # Runs in a pool worker (main thread), so the budget counts from when the
+    # task starts, not from when it was queued behind other jobs' pages.
+    # SIGALRM interrupts pure-Python work such as pdfminer; tesseract and
+    # pdftoppm are given the same budget and stop on their own first.
+    if not budget:
+        return fn(*args)
+
+    def expired(signum, frame):
+        raise OcrTimeout(stage, kind)
+
+    previous = signal.signal(signal.SIGALRM, expired)
+    signal.setitimer(signal.ITIMER_REAL, budget + _KILL_GRACE_SECONDS)
+    try:
+        return fn(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def _wait_started(futures: List[Future], budget: Optional[float]) -> bool:
+    # Wait for `futures`; False if one kept running well past its budget,
+    # i.e. it is stuck in native code the alarm can't interrupt (tesserocr).
+    # A future counts as running once it is handed to the workers, which can
+    # be up to one task early, hence twice the budget.
+    if budget is None:
+        wait(futures)
+        return True
+    limit = 2 * (budget + _KILL_GRACE_SECONDS)
+    running_since: Dict[Future, float] = {}
+    while True:
+        _done, pending = wait(futures, timeout=1.0)
+        if not pending:
+            return True
+        now = time.monotonic()
+        for f in pending:
+            if f.running():
+                running_since.setdefault(f, now)
+        if any(now - t > limit for f, t in running_since.items() if not f.done()):
+            return False
+
+def _run_pooled(fn, arg_lists: Sequence[tuple], budget: Optional[float], stage: str, kind: str) -> list:
+    # Run fn(*args) for each entry in the pool and return results in order.
+    # Each task gets `budget` seconds from its own start. A pool broken,
+    # cancelled or shut down because of another job's runaway task is
+    # replaced and the batch retried once.
+    for attempt in (1, 2):
+        pool = _get_pool()
+        try:
+            futures: List[Future] = [pool.submit(_budgeted, fn, args, budget, stage, kind) for args in arg_lists]
+        except RuntimeError:
+            # shut down between _get_pool() and submit()
+            _discard_pool(pool)
+            if attempt == 2:
+                raise
+            continue
+        if not _wait_started(futures, budget):
+            _discard_pool(pool, kill=True)
+            raise OcrTimeout(stage, kind)
+        try:
+            return [f.result() for f in futures]
+        except (BrokenProcessPool, CancelledError):
+            _discard_pool(pool)
+            if attempt == 2:
+                raise
+    return []
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+class OcrBackend:
+    name = ""
+
+    def version(self) -> str:
+        return ""
+
+    def image_to_string(self, img: Image.Image, lang: str, timeout: float = 0) -> str:
+        raise NotImplementedError
+
+    def recognize(self, img: Image.Image, lang: str, timeout: float = 0) -> Tuple[str, float]:
+        # (text, mean word confidence 0-100); -1 when the backend can't tell
+        return self.image_to_string(img, lang, timeout), -1.0
+
+    def detect_rotation(self, img: Image.Image, timeout: float = 0) -> int:
+        # Clockwise degrees (0/90/180/270) that make the page upright.
+        return 0
+
+class PytesseractBackend(OcrBackend):
+    # One `tesseract` process per page.
+    name = "pytesseract"
+
+    def version(self) -> str:
+        try:
+            return str(pytesseract.get_tesseract_version())
+        except Exception:
+            return "unknown"
+
+    # pytesseract kills tesseract itself once `timeout` passes.
+    def image_to_string(self, img: Image.Image, lang: str, timeout: float = 0) -> str:
+        return pytesseract.image_to_string(img, lang=lang, timeout=timeout)
+
+    def recognize(self, img: Image.Image, lang: str, timeout: float = 0) -> Tuple[str, float]:
+        data = pytesseract.image_to_data(img, lang=lang, output_type=pytesseract.Output.DICT, timeout=timeout)
+        lines: List[str] = []
+        words: List[str] = []
+        confs: List[float] = []
+        line_key = None
+        par_key = None
+        for i, word in enumerate(data["text"]):
+            key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            if key != line_key:
+                if words:
+                    lines.append(" ".join(words))
+                    words = []
+                if par_key is not None and key[:2] != par_key:
+                    lines.append("")
+                line_key, par_key = key, key[:2]
+            word = (word or "").strip()
+            if word:
+                words.append(word)
+                conf = float(data["conf"][i])
+                if conf >= 0:
+                    confs.append(conf)
+        if words:
+            lines.append(" ".join(words))
+        return "\n".join(lines) + "\n", (sum(confs) / len(confs) if confs else -1.0)
+
+    def detect_rotation(self, img: Image.Image, timeout: float = 0) -> int:
+        try:
+            osd = pytesseract.image_to_osd(img, output_type=pytesseract.Output.DICT, timeout=timeout)
+        except pytesseract.TesseractError:
+            # too little text to decide
+            return 0
+        return int(osd.get("rotate") or 0)
+
+class TesserocrBackend(OcrBackend):
+    # In-process libtesseract. Initialized API handles are pooled per language
+    # and reused, so language data is loaded once per handle, not per page.
+    name = "tesserocr"
+
+    def __init__(self) -> None:
+        try:
+            import tesserocr
+        except ImportError:
+            raise RuntimeError("ODM_OCR_BACKEND=tesserocr requires the 'tesserocr' package")
+        self._tesserocr = tesserocr
+        self._handles: Dict[str, "queue.LifoQueue"] = {}
+        self._lock = threading.Lock()
+
+    def version(self) -> str:
+        return str(self._tesserocr.tesseract_version()).splitlines()[0]
+
+    def _acquire(self, lang: str, osd: bool = False):
+        key = "osd" if osd else lang
+        with self._lock:
+            handles = self._handles.setdefault(key, queue.LifoQueue())
+        try:
+            return handles.get_nowait()
+        except queue.Empty:
+            if osd:
+                return self._tesserocr.PyTessBaseAPI(psm=self._tesserocr.PSM.OSD_ONLY)
+            return self._tesserocr.PyTessBaseAPI(lang=lang)
+
+    def _release(self, lang: str, api, osd: bool = False) -> None:
+        self._handles["osd" if osd else lang].put(api)
+
+    # No timeout support in-process; the pool kills the worker instead.
+    def image_to_string(self, img: Image.Image, lang: str, timeout: float = 0) -> str:
+        api = self._acquire(lang)
+        try:
+            api.SetImage(img)
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+            self._release(lang, api)
+
+    def recognize(self, img: Image.Image, lang: str, timeout: float = 0) -> Tuple[str, float]:
+        api = self._acquire(lang)
+        try:
+            api.SetImage(img)
+            return api.GetUTF8Text(), float(api.MeanTextConf())
+        finally:
+            api.Clear()
+            self._release(lang, api)
+
+    def detect_rotation(self, img: Image.Image, timeout: float = 0) -> int:
+        api = self._acquire("", osd=True)
+        try:
+            api.SetImage(img)
+            result = api.DetectOrientationScript()
+        except RuntimeError:
+            return 0
+        finally:
+            api.Clear()
+            self._release("", api, osd=True)
+        # orient_deg is the counter-clockwise rotation of the scanned page
+        return (360 - int((result or {}).get("orient_deg") or 0)) % 360
+
+class StubBackend(OcrBackend):
+    # No OCR at all; for tests and for benchmarking the rest of the pipeline.
+    name = "stub"
+
+    def version(self) -> str:
+        return "1"
+
+    def image_to_string(self, img: Image.Image, lang: str, timeout: float = 0) -> str:
+        return f"stub ocr {img.width}x{img.height}\n"
+
+    def recognize(self, img: Image.Image, lang: str, timeout: float = 0) -> Tuple[str, float]:
+        return self.image_to_string(img, lang), 100.0
+
+_BACKENDS = {b.name: b for b in (PytesseractBackend, TesserocrBackend, StubBackend)}
+_backends: Dict[str, OcrBackend] = {}
+_backends_lock = threading.Lock()
+
+def get_backend(name: Optional[str] = None) -> OcrBackend:
+    # One instance per process: pool workers each keep their own handles.
+    name = (name or settings.ocr_backend or "pytesseract").strip().lower()
+    with _backends_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            if name not in _BACKENDS:
+                raise RuntimeError(f"Unknown OCR backend: {name}")
+            backend = _backends[name] = _BACKENDS[name]()
+        return backend
+
+def preprocess_steps() -> Tuple[str, ...]:
+    wanted = {p.strip().lower() for p in (settings.ocr_preprocess or "").split(",") if p.strip()}
+    return tuple(step for step in PREPROCESS_STEPS if step in wanted)
+
+def _otsu_threshold(gray: Image.Image) -> int:
+    hist = gray.histogram()[:256]
+    total = sum(hist)
+    sum_all = sum(i * h for i, h in enumerate(hist))
+    sum_bg = weight_bg = 0
+    best_t, best_var = 127, -1.0
+    for t in range(256):
+        weight_bg += hist[t]
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += t * hist[t]
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        var = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if var > best_var:
+            best_t, best_var = t, var
+    return best_t
+
+def _skew_angle(gray: Image.Image) -> float:
+    # Projection profile: the rotation at which text lines give the sharpest
+    # row-to-row contrast. Row means come from a 1px-wide BOX resize, so the
+    # search stays in C even for large pages.
+    thumb = gray.copy()
+    thumb.thumbnail((1000, 1000))
+    t = _otsu_threshold(thumb)
+    ink = thumb.point([255 if v <= t else 0 for v in range(256)])
+    best_angle, best_score = 0.0, -1.0
+    for step in range(-2 * _MAX_SKEW_DEGREES, 2 * _MAX_SKEW_DEGREES + 1):
+        angle = step / 2
+        rows = list(ink.rotate(angle, resample=Image.Resampling.BILINEAR, fillcolor=0)
+                    .resize((1, ink.height), Image.Resampling.BOX).getdata())
+        score = float(sum((b - a) ** 2 for a, b in zip(rows, rows[1:])))
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+def _preprocess(img: Image.Image, opts: OcrOptions) -> Image.Image:
+    steps = opts.preprocess
+    if "autorotate" in steps:
+        img = ImageOps.exif_transpose(img)
+    if "downscale" in steps:
+        max_side = int(opts.target_dpi * _PAGE_LONG_SIDE_INCHES)
+        if max(img.size) > max_side:
+            scale = max_side / max(img.size)
+            img = img.resize(
+                (max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                Image.Resampling.LANCZOS,
+            )
+    if "grayscale" in steps or "deskew" in steps or "binarize" in steps:
+        if img.mode != "L":
+            img = img.convert("L")
+    if "autorotate" in steps:
+        rotate = get_backend(opts.backend).detect_rotation(img, opts.timeout)
+        if rotate:
+            img = img.rotate(-rotate, expand=True, fillcolor="white")
+    if "deskew" in steps:
+        angle = _skew_angle(img)
+        if abs(angle) >= 0.5:
+            img = img.rotate(angle, resample=Image.Resampling.BICUBIC, expand=True, fillcolor="white")
+    if "binarize" in steps:
+        t = _otsu_threshold(img)
+        img = img.point([255 if v > t else 0 for v in range(256)])
+    return img
+
+def _ocr_image(img: Image.Image, opts: OcrOptions) -> PageText:
+    t0 = time.perf_counter()
+    try:
+        if opts.preprocess:
+            img = _preprocess(img, opts)
+        t1 = time.perf_counter()
+        # tesseract gets what preprocessing left of the page budget, so it
+        # stops before the pool's alarm and is never orphaned
+        timeout = max(1.0, opts.timeout - (t1 - t0)) if opts.timeout else 0
+        backend = get_backend(opts.backend)
+        if opts.confidence:
+            text, conf = backend.recognize(img, opts.lang, timeout)
+        else:
+            text, conf = backend.image_to_string(img, opts.lang, timeout), -1.0
+    except RuntimeError as e:
+        # pytesseract's own timeout
+        if "timeout" in str(e).lower():
+            raise OcrTimeout("ocr", "page")
+        raise
+    return PageText(text, conf, t1 - t0, time.perf_counter() - t1)
+
+def _ocr_options(confidence: bool = False, timeout: Optional[float] = None) -> OcrOptions:
+    return OcrOptions(
+        lang=settings.tesseract_lang,
+        backend=get_backend().name,
+        confidence=confidence,
+        preprocess=preprocess_steps(),
+        target_dpi=settings.ocr_target_dpi,
+        timeout=timeout or 0,
+    )
+
+def _ocr_images(images: List[Image.Image], confidence: bool = False, deadline: Optional[Deadline] = None) -> List[PageText]:
+    deadline = deadline or Deadline()
+    n = len(images)
+    page_budget = deadline.budget("ocr")
+    opts = _ocr_options(confidence, page_budget)
+    # tesseract stops itself at its timeout, so a single page (or every page
+    # with one worker) runs in this thread and a large photo isn't pickled to
+    # the pool. In-process tesserocr can't be stopped: under a budget it
+    # always goes through the pool.
+    stoppable = not deadline.enabled or opts.backend != "tesserocr"
+    if stoppable and (n <= 1 or ocr_workers() == 1):
+        out = [_ocr_image(img, opts) for img in images]
+    else:
+        # Results come back in page order regardless of which worker finishes
+        # first.
+        out = _run_pooled(_ocr_image, [(img, opts) for img in images], page_budget, "ocr", deadline.kind("ocr"))
+    with _timings_lock:
+        _timings["pages"] += len(out)
+        _timings["preprocess_s"] += sum(p.preprocess_s for p in out)
+        _timings["ocr_s"] += sum(p.ocr_s for p in out)
+    return out
+
+def ocr_timings() -> Dict[str, float]:
+    with _timings_lock:
+        return dict(_timings)
+
+def page_window() -> int:
+    return max(1, int(settings.ocr_page_window or 1))
+
+def _pdf_page_count(path: str, deadline: Optional[Deadline] = None) -> int:
+    deadline = deadline or Deadline()
+    try:
+        info = pdfinfo_from_path(path, timeout=deadline.budget("pdfinfo"))
+    except PDFPopplerTimeoutError:
+        raise OcrTimeout("pdfinfo", deadline.kind("pdfinfo"))
+    return int(info.get("Pages") or 0)
+
+def page_count(path: str) -> int:
+    # Cheap size estimate for scheduling; 0 when unknown.
+    try:
+        if os.path.splitext(path)[1].lower() == ".pdf":
+            return _pdf_page_count(path)
+        with Image.open(path) as img:
+            return int(getattr(img, "n_frames", 1) or 1)
+    except Exception:
+        return 0
+
+def _page_runs(pages: Sequence[int], window: int) -> Iterator[Tuple[int, int]]:
+    # Group 1-based page numbers into (first, last) runs of consecutive pages,
+    # each at most `window` long, so pdftoppm can render a run in one call.
+    first = last = None
+    for p in sorted(pages):
+        if first is not None and p == last + 1 and p - first < window:
+            last = p
+            continue
+        if first is not None:
+            yield first, last
+        first = last = p
+    if first is not None:
+        yield first, last
+
+def _render_dir():
+    # "memory": pdftoppm streams pages over a pipe, nothing touches the disk.
+    # "disk": pages go to a per-job scratch directory (which may be a tmpfs).
+    if (settings.ocr_render_mode or "memory").strip().lower() == "disk":
+        return scratch.job_dir("ocr")
+    return nullcontext(None)
+
+def _page_bytes_estimate(dpi: int) -> int:
+    # Letter-size RGB page, uncompressed: a safe upper bound for the PNG.
+    return int(8.5 * dpi) * int(11 * dpi) * 3
+
+def _iter_pdf_windows(
+    path: str, dpi: int, pages: Sequence[int], deadline: Deadline, output_folder: Optional[str] = None
+) -> Iterator[Tuple[List[int], List[Image.Image]]]:
+    # Render at most page_window() pages at a time so memory (and scratch
+    # disk) is bounded by the window, not by the length of the document.
+    for first, last in _page_runs(pages, page_window()):
+        n = last - first + 1
+        with scratch.reserve(_page_bytes_estimate(dpi) * n) if output_folder else nullcontext():
+            threads = min(ocr_workers(), n)
+            try:
+                # pdf2image kills pdftoppm when the timeout passes
+                images = convert_from_path(
+                    path, dpi=dpi, fmt="png", output_folder=output_folder,
+                    first_page=first, last_page=last, thread_count=threads,
+                    timeout=deadline.budget("render", -(-n // threads)),
+                )
+            except PDFPopplerTimeoutError:
+                raise OcrTimeout("render", deadline.kind("render", -(-n // threads)))
+            try:
+                yield list(range(first, last + 1)), images
+            finally:
+                if output_folder:
+                    for img in images:
+                        try:
+                            os.remove(img.filename)
+                        except OSError:
+                            pass
+
+def _ocr_pdf(
+    path: str, pages: Sequence[int], dpi: int, deadline: Deadline, confidence: bool = False
+) -> Dict[int, PageText]:
+    out: Dict[int, PageText] = {}
+    with _render_dir() as output_folder:
+        for numbers, images in _iter_pdf_windows(path, dpi, pages, deadline, output_folder):
+            try:
+                out.update(zip(numbers, _ocr_images(images, confidence, deadline)))
+            finally:
+                for img in images:
+                    img.close()
+    return out
+
+def _ocr_pdf_adaptive(
+    path: str, pages: Sequence[int], deadline: Deadline
+) -> Tuple[Dict[int, PageText], Dict[int, int]]:
+    # OCR everything at the low DPI first, then re-render only the pages whose
+    # mean word confidence is below the threshold, keeping the better result.
+    low = settings.ocr_adaptive_low_dpi
+    high = settings.ocr_adaptive_high_dpi
+    results = _ocr_pdf(path, pages, low, deadline, confidence=True)
+    page_dpi = {p: low for p in results}
+    retry = [p for p, r in results.items() if 0 <= r.confidence < settings.ocr_min_confidence]
+    if retry and high > low:
+        for p, r in _ocr_pdf(path, retry, high, deadline, confidence=True).items():
+            # keep the low-DPI timings in the totals: that work was done too
+            r.preprocess_s += results[p].preprocess_s
+            r.ocr_s += results[p].ocr_s
+            if r.confidence >= results[p].confidence:
+                page_dpi[p] = high
+            else:
+                r.text, r.confidence = results[p].text, results[p].confidence
+            results[p] = r
+    return results, page_dpi
+
+def _mean_confidence(results) -> float:
+    confs = [r.confidence for r in results if r.confidence >= 0]
+    return sum(confs) / len(confs) if confs else -1.0
+
+def _with_timings(r: OcrResult, pages) -> OcrResult:
+    pages = list(pages)
+    r.preprocess_ms = int(sum(p.preprocess_s for p in pages) * 1000)
+    r.ocr_ms = int(sum(p.ocr_s for p in pages) * 1000)
+    return r
+
+def _iter_frame_windows(img: Image.Image, max_frames: int = 0) -> Iterator[List[Image.Image]]:
+    # Multi-frame images (fax TIFFs): decode one frame at a time, in windows
+    # of page_window() frames, so memory stays flat however many pages.
+    window = page_window()
+    batch: List[Image.Image] = []
+    for i, frame in enumerate(ImageSequence.Iterator(img)):
+        if max_frames and i >= max_frames:
+            break
+        batch.append(frame.copy())
+        if len(batch) >= window:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _has_text(text: str) -> bool:
+    return len(text.strip()) >= MIN_PAGE_TEXT_CHARS
+
+def _pdfminer_page_texts(path: str, first: int = 1, last: int = 0) -> List[str]:
+    # Pages before `first` are skipped without layout analysis.
+    texts: List[str] = []
+    pagenos = range(first - 1, last or 10 ** 9) if first > 1 else None
+    for layout in extract_pages(path, page_numbers=pagenos, maxpages=last):
+        out: List[str] = []
+        _render_layout(layout, out)
+        texts.append("".join(out))
+    return texts
+
+def _render_layout(item, out: List[str]) -> None:
+    # As pdfminer's TextConverter: recurse into every container, figures
+    # (Form XObjects) included, not just the page's top-level text boxes.
+    if isinstance(item, LTContainer):
+        for child in item:
+            _render_layout(child, out)
+    elif isinstance(item, LTText):
+        out.append(item.get_text())
+    if isinstance(item, LTTextBox):
+        out.append("\n")
+
+def _pdftotext_page_texts(path: str, first: int, last: int, timeout: Optional[float]) -> List[str]:
+    # poppler's pdftotext: much faster than pdfminer on large digital PDFs.
+    cmd = ["pdftotext", "-q", "-enc", "UTF-8", "-f", str(first)]
+    if last:
+        cmd += ["-l", str(last)]
+    proc = subprocess.run(cmd + [path, "-"], capture_output=True, timeout=timeout, check=True)
+    # one form feed after every page
+    return proc.stdout.decode("utf-8", errors="replace").split("\f")[:-1]
+
+def _pdf_page_texts(path: str, deadline: Deadline, first: int = 1, last: int = 0) -> List[str]:
+    if (settings.pdf_text_backend or "pdfminer").strip().lower() == "pdftotext":
+        pages = (last - first + 1) if last else max(1, _pdf_page_count(path, deadline) - first + 1)
+        try:
+            return _pdftotext_page_texts(path, first, last, deadline.budget("pdf-text", pages))
+        except subprocess.TimeoutExpired:
+            raise OcrTimeout("pdf-text", deadline.kind("pdf-text", pages))
+        except (OSError, subprocess.CalledProcessError):
+            pass  # fall back to pdfminer
+
+    # pdfminer is pure Python and can't be interrupted, so under a budget it
+    # runs in the pool where a runaway parse can be killed.
+    if not deadline.enabled:
+        return _pdfminer_page_texts(path, first, last)
+    pages = _pdf_page_count(path, deadline)
+    pages = (min(pages, last) if last else pages) - first + 1
+    return _run_pooled(
+        _pdfminer_page_texts, [(path, first, last)],
+        deadline.budget("pdf-text", pages), "pdf-text", deadline.kind("pdf-text", pages),
+    )[0]
+
+def _rest_has_text(path: str, deadline: Deadline, first: int, last: int) -> bool:
+    # Cheap check of pages first..last with pdftotext, whichever backend
+    # extracts the text: a scanned cover sheet in front of a digital invoice
+    # must not send the digital pages to OCR. Unknown (no pdftotext) = no.
+    pages = (last - first + 1) if last else max(1, _pdf_page_count(path, deadline) - first + 1)
+    try:
+        texts = _pdftotext_page_texts(path, first, last, deadline.budget("pdf-text", pages))
+    except subprocess.TimeoutExpired:
+        raise OcrTimeout("pdf-text", deadline.kind("pdf-text", pages))
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return any(_has_text(t) for t in texts)
+
+def _embedded_texts(path: str, deadline: Deadline, max_pages: int = 0) -> Tuple[List[str], bool]:
+    # Returns (texts, whole): `whole` is False when the probe of the first
+    # ODM_PDF_PROBE_PAGES pages found no text layer and neither did a quick
+    # pdftotext pass over the rest; such a document is treated as scanned.
+    probe = max(0, int(settings.pdf_probe_pages or 0))
+    if not probe or (max_pages and max_pages <= probe):
+        return _pdf_page_texts(path, deadline, 1, max_pages), True
+    head = _pdf_page_texts(path, deadline, 1, probe)
+    if len(head) < probe:
+        return head, True
+    if not any(_has_text(t) for t in head) and not _rest_has_text(path, deadline, probe + 1, max_pages):
+        return head, False
+    return head + _pdf_page_texts(path, deadline, probe + 1, max_pages), True
+
+@functools.lru_cache(maxsize=None)
+def _backend_version(name: str) -> str:
+    return get_backend(name).version()
+
+def _dpi_fingerprint() -> str:
+    if settings.ocr_adaptive_dpi:
+        return (
+            f"adaptive:{settings.ocr_adaptive_low_dpi}-{settings.ocr_adaptive_high_dpi}"
+            f"@{settings.ocr_min_confidence}"
+        )
+    return str(settings.ocr_dpi)
+
+def ocr_fingerprint() -> str:
+    # Everything that can change the extracted text for identical file bytes.
+    backend = get_backend().name
+    return "|".join([
+        f"lang={settings.tesseract_lang}",
+        f"extract={_EXTRACT_VERSION}",
+        f"dpi={_dpi_fingerprint()}",
+        f"backend={backend}:{_backend_version(backend)}",
+        f"preprocess={','.join(preprocess_steps())}@{settings.ocr_target_dpi}",
+        f"pdftext={settings.pdf_text_backend}@{settings.pdf_probe_pages}",
+        f"pdfminer={getattr(pdfminer, '__version__', '')}",
+    ])
+
 def get_text(path: str) -> Tuple[str, str]:
+    r = extract(path)
+    return r.text, r.method
+
+def extract(
+    path: str, max_pages: Optional[int] = None, dpi: Optional[int] = None, deadline: Optional[Deadline] = None,
+    reuse: Optional[Dict[int, PageText]] = None,
+) -> OcrResult:
+    # Partial extractions (max_pages) are never cached, but a cached full
+    # result is always good enough to answer them. `reuse` holds pages
+    # already OCR'd at the DPI this extraction would use (the progressive
+    # first pass); they are not OCR'd again.
+    deadline = deadline or Deadline()
+    reuse = reuse or {}
+    if not settings.ocr_cache_enabled:
+        return _extract(path, max_pages, dpi, deadline, reuse)
+
+    key = ocr_cache.cache_key(ocr_cache.file_digest(path), ocr_fingerprint())
+    try:
+        cached = ocr_cache.lookup(key)
+    except Exception:
+        cached = None  # e.g. database locked by another writer: a miss
+    if cached is not None:
+        return OcrResult(
+            text=cached.text, method=cached.method, dpi=cached.dpi, confidence=cached.confidence
+        )
+
+    r = _extract(path, max_pages, dpi, deadline, reuse)
+    if r.complete and not dpi:
+        try:
+            ocr_cache.store(key, r.text, r.method, dpi=r.dpi, confidence=r.confidence)
+        except Exception:
+            pass
+    return r
+
+def _extract(
+    path: str, max_pages: Optional[int], dpi: Optional[int], deadline: Deadline, reuse: Dict[int, PageText]
+) -> OcrResult:
+    # An explicit dpi (e.g. the progressive first pass) bypasses adaptive DPI.
+    adaptive = settings.ocr_adaptive_dpi and not dpi
+    dpi = dpi or settings.ocr_dpi
     ext = os.path.splitext(path)[1].lower()
     if ext == ".pdf":
-        # 1) embedded text
+        # 1) embedded text, page by page
         try:
-            text = pdf_extract_text(path) or ""
-            if len(text.strip()) >= 30:
-                return text, "pdf-text"
+            texts, whole = _embedded_texts(path, deadline, max_pages or 0)
+        except OcrTimeout:
+            raise
         except Exception:
-            pass
+            texts, whole = [], False
 
-        # 2) OCR pages
-        text_parts = []
+        # 2) OCR only the pages without a usable text layer
         try:
-            images = convert_from_path(path, dpi=200, fmt="png", output_folder=settings.tmp_dir)
-            for img in images:
-                text_parts.append(pytesseract.image_to_string(img, lang=settings.tesseract_lang))
-            return "\n".join(text_parts), "pdf-ocr"
+            total = len(texts) if (whole and texts and not max_pages) else _pdf_page_count(path, deadline)
+            wanted = min(total, max_pages) if max_pages else total
+            texts = (texts + [""] * wanted)[:wanted]
+            complete = wanted >= total
+            missing = [i + 1 for i, t in enumerate(texts) if not _has_text(t)]
+            if not missing:
+                return OcrResult("\n".join(texts), "pdf-text", total, complete)
+            todo = [p for p in missing if p not in reuse]
+            if adaptive:
+                results, page_dpi = _ocr_pdf_adaptive(path, todo, deadline) if todo else ({}, {})
+            else:
+                results = _ocr_pdf(path, todo, dpi, deadline) if todo else {}
+                page_dpi = {p: dpi for p in results}
+            for p in missing:
+                if p in reuse:
+                    results[p] = reuse[p]
+                    page_dpi[p] = dpi
+            for page_no, page in results.items():
+                texts[page_no - 1] = page.text
+        except OcrTimeout:
+            raise
         except Exception as e:
             raise RuntimeError(f"OCR failed for PDF: {e}")
+        method = "pdf-ocr" if len(missing) == len(texts) else "pdf-hybrid"
+        return _with_timings(OcrResult(
+            "\n".join(texts), method, total, complete,
+            dpi=max(page_dpi.values(), default=0), confidence=_mean_confidence(results.values()),
+            ocr_pages=dict(results),
+        ), results.values())
 
-    # image OCR
+    # image OCR, frame by frame
     try:
         with Image.open(path) as img:
-            return pytesseract.image_to_string(img, lang=settings.tesseract_lang), "image-ocr"
+            total = int(getattr(img, "n_frames", 1) or 1)
+            pages: List[PageText] = []
+            for frames in _iter_frame_windows(img, max_pages or 0):
+                try:
+                    first = len(pages) + 1
+                    numbers = [first + i for i in range(len(frames)) if first + i not in reuse]
+                    done = dict(zip(numbers, _ocr_images(
+                        [frames[n - first] for n in numbers], settings.ocr_adaptive_dpi, deadline,
+                    ))) if numbers else {}
+                    pages.extend(done.get(n) or reuse[n] for n in range(first, first + len(frames)))
+                finally:
+                    for frame in frames:
+                        frame.close()
+            return _with_timings(OcrResult(
+                "\n".join(p.text for p in pages), "image-ocr", total, len(pages) >= total,
+                confidence=_mean_confidence(pages), ocr_pages=dict(enumerate(pages, 1)),
+            ), pages)
+    except OcrTimeout:
+        raise
     except Exception as e:
         raise RuntimeError(f"OCR failed for image: {e}")
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import func
+from sqlmodel import select
+
+from .db import get_session
+from .models import OcrCacheEntry
+from .settings import settings
+
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+_lock = threading.Lock()
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def cache_key(digest: str, fingerprint: str) -> str:
+    return hashlib.sha256(f"{digest}|{fingerprint}".encode("utf-8")).hexdigest()
+
+def _count(name: str, n: int = 1) -> None:
+    with _lock:
+        _stats[name] += n
+
+def lookup(key: str) -> Optional[OcrCacheEntry]:
+    with get_session() as s:
+        entry = s.get(OcrCacheEntry, key)
+        if not entry:
+            _count("misses")
+            return None
+        entry.hits += 1
+        entry.last_used_at = datetime.utcnow()
+        s.add(entry)
+        s.commit()
+        s.refresh(entry)
+        _count("hits")
+        return entry
+
+def store(key: str, text: str, method: str, dpi: int = 0, confidence: float = -1.0) -> None:
+    size = len(text.encode("utf-8"))
+    with get_session() as s:
+        entry = s.get(OcrCacheEntry, key) or OcrCacheEntry(key=key)
+        entry.text = text
+        entry.method = method
+        entry.dpi = dpi
+        entry.confidence = confidence
+        entry.size_bytes = size
+        entry.last_used_at = datetime.utcnow()
+        s.add(entry)
+        s.commit()
+        _evict(s)
+
+def _evict(s) -> None:
+    max_bytes = max(0, int(settings.ocr_cache_max_mb or 0)) * 1024 * 1024
+    total = s.exec(select(func.coalesce(func.sum(OcrCacheEntry.size_bytes), 0))).one()
+    if total <= max_bytes:
+        return
+    # least recently used first
+    evicted = 0
+    for entry in s.exec(select(OcrCacheEntry).order_by(OcrCacheEntry.last_used_at.asc())):
+        if total <= max_bytes:
+            break
+        total -= entry.size_bytes
+        s.delete(entry)
+        evicted += 1
+    s.commit()
+    _count("evictions", evicted)
+
+def stats() -> Dict[str, int]:
+    with _lock:
+        out = dict(_stats)
+    with get_session() as s:
+        entries, size = s.exec(
+            select(func.count(OcrCacheEntry.key), func.coalesce(func.sum(OcrCacheEntry.size_bytes), 0))
+        ).one()
+    out["entries"] = int(entries or 0)
+    out["size_bytes"] = int(size or 0)
+    return out
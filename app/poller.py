@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set, Tuple
+
+from .processor import SUPPORTED_EXTS
+from .workqueue import WorkQueue
+
+# Filesystems where inotify events never arrive for changes made by other
+# hosts.
+NETWORK_FS_TYPES = {
+    "cifs", "smb3", "smbfs", "nfs", "nfs4", "9p", "afs", "ceph", "glusterfs",
+    "fuse.sshfs", "fuse.rclone", "davfs", "fuse.davfs2",
+}
+
+# Directory mtimes on network shares can be as coarse as 2 s; a directory
+# whose mtime is this close to our last listing is listed again.
+_MTIME_SLACK_NS = 2_000_000_000
+
+def _unescape_mount(path: str) -> str:
+    return path.replace("\\040", " ").replace("\\011", "\t").replace("\\012", "\n").replace("\\134", "\\")
+
+def fs_type(path: str) -> str:
+    # Type of the filesystem holding `path`, from /proc/mounts ("" if unknown).
+    path = os.path.realpath(path)
+    best, best_type = "", ""
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                mnt = _unescape_mount(parts[1])
+                if (path == mnt or path.startswith(mnt.rstrip("/") + "/")) and len(mnt) >= len(best):
+                    best, best_type = mnt, parts[2]
+    except OSError:
+        return ""
+    return best_type
+
+def is_network_fs(path: str) -> bool:
+    return fs_type(path) in NETWORK_FS_TYPES
+
+@dataclass
+class _DirState:
+    mtime_ns: int
+    listed_at_ns: int
+    files: Dict[str, Tuple[int, int, int]] = field(default_factory=dict)  # name -> (size, mtime_ns, inode)
+    subdirs: Set[str] = field(default_factory=set)
+
+class PollingWatcher:
+    # Stand-in for watchdog's Observer on network filesystems. Keeps a
+    # snapshot of (size, mtime, inode) per file and diffs it every
+    # `interval` seconds. A directory whose own mtime did not change has no
+    # added, removed or renamed entries, so it is not listed again: a tick
+    # costs one stat per directory plus listings of the directories that
+    # changed. In-place rewrites of an existing file are left to the
+    # reconciliation sweep.
+
+    def __init__(self, root: str, queue: WorkQueue, interval: float = 10.0) -> None:
+        self.root = os.path.abspath(root)
+        self.interval = max(1.0, float(interval))
+        self._queue = queue
+        self._dirs: Dict[str, _DirState] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_tick: Dict[str, object] = {}
+
+    def _list(self, path: str, st: os.stat_result, prev: Optional[_DirState], emit: bool) -> _DirState:
+        state = _DirState(mtime_ns=st.st_mtime_ns, listed_at_ns=time.time_ns())
+        try:
+            it = os.scandir(path)
+        except OSError:
+            return state
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        state.subdirs.add(entry.name)
+                        continue
+                    if not entry.is_file() or os.path.splitext(entry.name)[1].lower() not in SUPPORTED_EXTS:
+                        continue
+                    est = entry.stat()
+                except OSError:
+                    continue
+                sig = (est.st_size, est.st_mtime_ns, est.st_ino)
+                state.files[entry.name] = sig
+                if emit and (prev is None or prev.files.get(entry.name) != sig):
+                    self._queue.put(entry.path)
+        return state
+
+    def _forget(self, path: str) -> None:
+        state = self._dirs.pop(path, None)
+        if state:
+            for name in state.subdirs:
+                self._forget(os.path.join(path, name))
+
+    def scan(self, emit: bool = True) -> Dict[str, int]:
+        # One tick. With emit=False only the snapshot is (re)built.
+        stats = {"dirs": 0, "listed": 0, "files": 0}
+        stack = [self.root]
+        while stack:
+            path = stack.pop()
+            try:
+                st = os.stat(path)
+            except OSError:
+                self._forget(path)
+                continue
+            stats["dirs"] += 1
+            prev = self._dirs.get(path)
+            if (
+                prev is None
+                or st.st_mtime_ns != prev.mtime_ns
+                or prev.listed_at_ns - st.st_mtime_ns < _MTIME_SLACK_NS
+            ):
+                state = self._list(path, st, prev, emit)
+                stats["listed"] += 1
+                if prev:
+                    for name in prev.subdirs - state.subdirs:
+                        self._forget(os.path.join(path, name))
+                self._dirs[path] = state
+            else:
+                state = prev
+            stats["files"] += len(state.files)
+            stack.extend(os.path.join(path, name) for name in state.subdirs)
+        return stats
+
+    def _run(self) -> None:
+        try:
+            # existing files are picked up by the reconciliation sweep
+            self.scan(emit=False)
+        except Exception:
+            pass
+        while not self._stop.wait(self.interval):
+            started = time.monotonic()
+            try:
+                stats = self.scan()
+            except Exception:
+                continue
+            self.last_tick = dict(stats, seconds=round(time.monotonic() - started, 3))
+
+    def start(self) -> None:
+        self._stop.clear()
+        t = threading.Thread(target=self._run, daemon=True, name="papertrellis-poller")
+        t.start()
+        self._thread = t
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        if self._thread:
+            self._thread.join(timeout)
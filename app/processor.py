@@ -2,30 +2,77 @@ from __future__ import annotations
 
 import os
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Tuple
 
 from sqlmodel import select
 
+from . import template_registry
 from .db import get_session
 from .models import Template, Job, Document
-from .ocr import get_text
-from .templating import evaluate_template, extract_fields, format_path_and_name
+from .ocr import Deadline, OcrResult, OcrTimeout, extract, get_text
+from .templating import CompiledTemplate, Extracted, extract_fields, format_path_and_name
 from .settings import settings
 from .utils import atomic_move, file_stat, safe_filename
 
 SUPPORTED_EXTS = {".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".webp"}
 
-def _choose_template(text: str) -> Optional[Template]:
+def _choose_template(text: str) -> Optional[CompiledTemplate]:
+    return template_registry.choose(text)
+
+def _fields_resolved(tpl: CompiledTemplate, extracted: Extracted) -> bool:
+    if tpl.template.company_regex and not extracted.company:
+        return False
+    if tpl.template.invoice_number_regex and not extracted.invoice_number:
+        return False
+    if tpl.template.date_regex and not extracted.date:
+        return False
+    return True
+
+def _classify(path: str) -> Tuple[OcrResult, Optional[CompiledTemplate], Optional[Extracted]]:
+    # One document budget covers both passes.
+    deadline = Deadline()
+    reuse = None
+
+    # Progressive mode: route from the first page(s) and only OCR the rest
+    # up front when no template matches or a field is still missing.
+    if settings.ocr_progressive:
+        r = extract(
+            path, max_pages=max(1, settings.ocr_progressive_pages),
+            dpi=settings.ocr_progressive_dpi or None, deadline=deadline,
+        )
+        tpl = _choose_template(r.text or "")
+        extracted = extract_fields(tpl, r.text or "") if tpl else None
+        if r.complete or (tpl and _fields_resolved(tpl, extracted)):
+            return r, tpl, extracted
+        # continue from the pages already OCR'd, if the full pass would
+        # have OCR'd them the same way (images aren't rasterized at all)
+        same_dpi = not settings.ocr_adaptive_dpi and settings.ocr_progressive_dpi in (0, settings.ocr_dpi)
+        if same_dpi or os.path.splitext(path)[1].lower() != ".pdf":
+            reuse = r.ocr_pages
+
+    r = extract(path, deadline=deadline, reuse=reuse)
+    tpl = _choose_template(r.text or "")
+    return r, tpl, (extract_fields(tpl, r.text or "") if tpl else None)
+
+def backfill_text(path: str) -> Tuple[str, str]:
+    # Full-text OCR for a document routed from its first pages only. Runs as
+    # a background-lane job; returns the job's (status, message).
+    path = os.path.abspath(path)
+    try:
+        text, method = get_text(path)
+    except OcrTimeout as e:
+        return "timeout", str(e)
+    except Exception as e:
+        return "failed", str(e)
     with get_session() as s:
-        templates = s.exec(select(Template).where(Template.enabled == True)).all()  # noqa: E712
-        best = None
-        best_score = -1
-        for tpl in templates:
-            ok, score = evaluate_template(tpl, text)
-            if ok and score >= best_score:
-                best = tpl
-                best_score = score
-        return best
+        doc = s.exec(select(Document).where(Document.abs_path == path)).first()
+        if not doc:
+            return "skipped", "Document is no longer in the library."
+        doc.ocr_text = (text or "")[:200000]
+        doc.updated_at = datetime.utcnow()
+        s.add(doc)
+        s.commit()
+    return "ok", f"Full text extracted (method={method})."
 
 def _ingest_relative_subdir(path: str) -> str:
     try:
@@ -73,18 +120,61 @@ def _tags_for_template(tpl: Template, company: str) -> List[str]:
             seen.add(t)
     return out
 
-def process_file(path: str, source: str = "ingest") -> Job:
+def move_to_failed(path: str, job: Job) -> Optional[str]:
+    # Ingest files that were not routed go to the failed folder, keeping
+    # their ingest subfolder, and are indexed there.
+    try:
+        if not os.path.exists(path):
+            return None
+        rel_subdir = _ingest_relative_subdir(path)
+        failed_dir = os.path.abspath(settings.failed_dir)
+        dest_dir = os.path.join(failed_dir, rel_subdir.replace("/", os.sep)) if rel_subdir else failed_dir
+        base_name = safe_filename(os.path.basename(path))
+        dest_path = os.path.join(dest_dir, base_name)
+        moved_to = atomic_move(path, dest_path)
+
+        size, mtime = file_stat(moved_to)
+        doc = Document(
+            location="failed",
+            abs_path=os.path.abspath(moved_to),
+            rel_path=os.path.relpath(os.path.abspath(moved_to), failed_dir).replace(os.sep, "/"),
+            filename=os.path.basename(moved_to),
+            ext=os.path.splitext(moved_to)[1].lower(),
+            status=job.status,
+            template_id=job.template_id,
+            extracted_company=job.extracted_company or "",
+            extracted_invoice_number=job.extracted_invoice_number or "",
+            extracted_date=job.extracted_date or "",
+            size_bytes=size,
+            mtime=mtime,
+        )
+        # tag it for easy filtering
+        if job.status == "timeout":
+            doc.set_tags(["failed", "timeout"])
+        else:
+            doc.set_tags(["failed"] if job.status == "failed" else ["unmatched"])
+        with get_session() as s:
+            s.add(doc)
+            s.commit()
+        return moved_to
+    except Exception:
+        return None
+
+def process_file(path: str, source: str = "ingest", job: Optional[Job] = None) -> Job:
+    # `job` is a leased queue job (app/jobqueue.py) to record the outcome on;
+    # without one a new Job row is created.
     original_name = os.path.basename(path)
     ext = os.path.splitext(original_name)[1].lower()
 
-    job = Job(
-        source=source,
-        input_path=path,
-        original_name=original_name,
-        status="failed",
-        message="",
-        created_at=datetime.utcnow()
-    )
+    if job is None:
+        job = Job(
+            source=source,
+            input_path=path,
+            original_name=original_name,
+            created_at=datetime.utcnow()
+        )
+    job.status = "failed"
+    job.message = ""
 
     if ext not in SUPPORTED_EXTS:
         job.status = "skipped"
@@ -94,10 +184,16 @@ def process_file(path: str, source: str = "ingest") -> Job:
         return job
 
     try:
-        text, method = get_text(path)
-        text = text or ""
+        result, tpl, extracted = _classify(path)
+        text = result.text or ""
+        method = result.method
+        job.ocr_dpi = result.dpi
+        job.ocr_confidence = result.confidence
+        job.ocr_preprocess_ms = result.preprocess_ms
+        job.ocr_ms = result.ocr_ms
+        if not result.complete:
+            method = f"{method}, first {settings.ocr_progressive_pages} of {result.pages} pages"
 
-        tpl = _choose_template(text)
         if not tpl:
             job.status = "skipped"
             job.message = f"No matching template (method={method})."
@@ -105,7 +201,6 @@ def process_file(path: str, source: str = "ingest") -> Job:
                 s.add(job); s.commit(); s.refresh(job)
             return job
 
-        extracted = extract_fields(tpl, text)
         out_rel, fname = format_path_and_name(tpl, extracted, os.path.splitext(original_name)[0], ext)
 
         # Preserve original ingest subfolder structure in the library
@@ -120,7 +215,7 @@ def process_file(path: str, source: str = "ingest") -> Job:
         moved_to = atomic_move(path, dest_path)
         size, mtime = file_stat(moved_to)
 
-        tags = _tags_for_template(tpl, extracted.company)
+        tags = _tags_for_template(tpl.template, extracted.company)
 
         doc = Document(
             location="library",
@@ -154,6 +249,17 @@ def process_file(path: str, source: str = "ingest") -> Job:
             s.add(doc)
             s.commit()
             s.refresh(job)
+
+        if not result.complete:
+            from .jobqueue import BACKGROUND, enqueue
+            enqueue(moved_to, source="backfill", lane=BACKGROUND)
+        return job
+
+    except OcrTimeout as e:
+        job.status = "timeout"
+        job.message = str(e)
+        with get_session() as s:
+            s.add(job); s.commit(); s.refresh(job)
         return job
 
     except Exception as e:
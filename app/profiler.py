@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import Dict, List, Tuple
+
+from sqlalchemy import func
+from sqlmodel import select
+
+from .db import get_session
+from .models import Document
+from .ocr import ocr_workers
+from .regex_guard import budget_seconds, compile_guarded, set_timeout_handler
+
+# Template regex profiling over stored OCR text (/templates/test).
+#
+# Every distinct regex of the enabled templates (match patterns and field
+# regexes) is run against a random sample of Document.ocr_text in a pool of
+# worker processes, each search timed on its own. The pool is private to
+# the run, so a runaway pattern can't hold up OCR: if the run outlives
+# _RUN_TIMEOUT_SECONDS the pool is killed and only finished chunks count.
+
+_CHUNK = 8
+_RUN_TIMEOUT_SECONDS = 120
+
+def _profile_chunk(patterns: List[str], texts: List[str]) -> List[List[Tuple[float, bool, bool]]]:
+    # Per text, per pattern: (ms, hit, timed out). Runs in a pool process;
+    # timeouts are only counted here, not recorded on the templates.
+    set_timeout_handler(None)
+    compiled = [compile_guarded(p) for p in patterns]
+    out = []
+    for text in texts:
+        row = []
+        for p in compiled:
+            if p is None:
+                row.append((0.0, False, False))
+                continue
+            start = time.perf_counter()
+            hit = p.search(text) is not None
+            ms = (time.perf_counter() - start) * 1000
+            timed_out = p.disabled or (budget_seconds() > 0 and ms > budget_seconds() * 1000)
+            p.disabled = False
+            row.append((ms, hit, timed_out))
+        out.append(row)
+    return out
+
+def _p95(values: List[float]) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(0.95 * (len(s) - 1))))]
+
+def _sample_texts(sample: int) -> List[str]:
+    with get_session() as s:
+        rows = s.exec(
+            select(Document.ocr_text).where(Document.ocr_text != "").order_by(func.random()).limit(sample)
+        ).all()
+    return [t for t in rows if t]
+
+def profile_templates(sample: int = 200) -> dict:
+    # imported here: pool processes load this module and must not register
+    # the registry's timeout handler, which disables patterns in the DB
+    from .template_registry import enabled_templates
+
+    templates = enabled_templates()
+    texts = _sample_texts(max(1, sample))
+
+    # distinct patterns and where each is used
+    patterns: List[str] = []
+    index: Dict[str, int] = {}
+    uses: List[List[Tuple[str, str]]] = []
+    disabled: List[Tuple[str, str, str]] = []
+    for ct in templates:
+        off = ct.template.disabled_patterns()
+        fields = [("match", p) for p in ct.template.match_patterns()] + [
+            (f, getattr(ct.template, f)) for f in ("company_regex", "invoice_number_regex", "date_regex")
+        ]
+        for field, pattern in fields:
+            if not pattern:
+                continue
+            if (field, pattern) in off:
+                disabled.append((ct.name, field, pattern))
+                continue
+            if pattern not in index:
+                index[pattern] = len(patterns)
+                patterns.append(pattern)
+                uses.append([])
+            uses[index[pattern]].append((ct.name, field))
+
+    started = time.monotonic()
+    rows: List[List[Tuple[float, bool, bool]]] = []
+    incomplete = 0
+    workers = 0
+    if patterns and texts:
+        chunks = [texts[i:i + _CHUNK] for i in range(0, len(texts), _CHUNK)]
+        workers = min(ocr_workers(), len(chunks))
+        # spawn, not fork: the web process is multi-threaded
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            futures = [pool.submit(_profile_chunk, patterns, chunk) for chunk in chunks]
+            done, pending = wait(futures, timeout=_RUN_TIMEOUT_SECONDS)
+            for f, chunk in zip(futures, chunks):
+                if f in done and f.exception() is None:
+                    rows.extend(f.result())
+                else:
+                    incomplete += len(chunk)
+            if pending:
+                for proc in list((getattr(pool, "_processes", None) or {}).values()):
+                    try:
+                        proc.kill()
+                    except Exception:
+                        pass
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    n = len(rows)
+    pattern_stats = []
+    for i, pattern in enumerate(patterns):
+        times = [row[i][0] for row in rows]
+        hits = sum(1 for row in rows if row[i][1])
+        pattern_stats.append({
+            "pattern": pattern,
+            "uses": uses[i],
+            "mean_ms": sum(times) / n if n else 0.0,
+            "p95_ms": _p95(times),
+            "max_ms": max(times) if times else 0.0,
+            "hit_rate": hits / n if n else 0.0,
+            "timeouts": sum(1 for row in rows if row[i][2]),
+        })
+    pattern_stats.sort(key=lambda p: -p["mean_ms"])
+
+    # which documents each template matches, as evaluate_template() decides
+    matched: List[set] = []
+    template_stats = []
+    for ct in templates:
+        off = ct.template.disabled_patterns()
+        # a disabled pattern never hits, even if another template runs it
+        idx = [None if ("match", p) in off else index.get(p) for p in ct.template.match_patterns()]
+        field_idx = [
+            index[getattr(ct.template, f)]
+            for f in ("company_regex", "invoice_number_regex", "date_regex")
+            if getattr(ct.template, f) in index and (f, getattr(ct.template, f)) not in off
+        ]
+        docs = set()
+        per_doc_ms = []
+        for d, row in enumerate(rows):
+            hits = [i is not None and row[i][1] for i in idx]
+            if idx and (any(hits) if ct.match_mode == "any" else all(hits)):
+                docs.add(d)
+            per_doc_ms.append(sum(row[i][0] for i in idx if i is not None) + sum(row[i][0] for i in field_idx))
+        matched.append(docs)
+        template_stats.append({
+            "id": ct.id,
+            "name": ct.name,
+            "match_rate": len(docs) / n if n else 0.0,
+            "mean_ms": sum(per_doc_ms) / n if n else 0.0,
+            "p95_ms": _p95(per_doc_ms),
+            "overlaps": [],
+        })
+    for a, stats in enumerate(template_stats):
+        for b, other in enumerate(template_stats):
+            both = len(matched[a] & matched[b])
+            if a != b and both:
+                stats["overlaps"].append({"name": other["name"], "docs": both})
+        stats["overlaps"].sort(key=lambda o: -o["docs"])
+
+    return {
+        "documents": n,
+        "incomplete": incomplete,
+        "workers": workers,
+        "seconds": round(time.monotonic() - started, 2),
+        "budget_ms": int(budget_seconds() * 1000),
+        "patterns": pattern_stats,
+        "templates": template_stats,
+        "disabled": disabled,
+    }
@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import re
+import time
+import warnings
+from typing import Callable, FrozenSet, Optional
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+try:
+    import regex as _regex
+except ImportError:
+    _regex = None
+
+from .settings import settings
+
+# Template regexes are user input run against up to 200 KB of OCR text.
+# Every search gets a time budget (ODM_REGEX_TIMEOUT_MS). With the optional
+# `regex` module the search is aborted when the budget runs out; with plain
+# `re` it can only be measured afterwards. Either way the pattern is
+# reported to the timeout handler (app/template_registry.py disables it)
+# and treated as not matching from then on.
+#
+# `re` semantics are the reference (the prefilter in app/matching.py
+# parses patterns with re's parser): a pattern only runs in `regex` if both
+# engines read it the same way, see _engines_agree().
+
+_FLAGS = re.IGNORECASE | re.MULTILINE
+
+_timeout_handler: Optional[Callable[[str, float], None]] = None
+
+def set_timeout_handler(fn: Optional[Callable[[str, float], None]]) -> None:
+    global _timeout_handler
+    _timeout_handler = fn
+
+def budget_seconds() -> float:
+    return max(0, int(settings.regex_timeout_ms or 0)) / 1000.0
+
+class GuardedPattern:
+    # Stands in for a compiled re.Pattern (search, pattern, flags; equal
+    # when pattern and flags are) with the time budget applied.
+    __slots__ = ("pattern", "flags", "disabled", "_re", "_rx")
+
+    def __init__(self, compiled: re.Pattern) -> None:
+        self.pattern = compiled.pattern
+        self.flags = compiled.flags
+        self.disabled = False
+        self._re = compiled
+        self._rx = None
+        if _regex is not None and _engines_agree(self.pattern):
+            try:
+                self._rx = _regex.compile(self.pattern, self.flags)
+            except Exception:
+                self._rx = None
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, GuardedPattern) and (self.pattern, self.flags) == (other.pattern, other.flags)
+
+    def __hash__(self) -> int:
+        return hash((self.pattern, self.flags))
+
+    def _timed_out(self, elapsed: float) -> None:
+        self.disabled = True
+        if _timeout_handler is not None:
+            try:
+                _timeout_handler(self.pattern, elapsed)
+            except Exception:
+                pass
+
+    def search(self, text: str):
+        if self.disabled:
+            return None
+        budget = budget_seconds()
+        if self._rx is not None and budget > 0:
+            try:
+                return self._rx.search(text, timeout=budget)
+            except TimeoutError:
+                self._timed_out(budget)
+                return None
+        start = time.perf_counter()
+        m = self._re.search(text)
+        elapsed = time.perf_counter() - start
+        if budget > 0 and elapsed > budget:
+            self._timed_out(elapsed)
+        return m
+
+# A "{" that re reads as a quantifier; any other unescaped "{" is a literal
+# to re but can be a fuzzy-matching constraint ({e<=1}) to `regex`.
+_QUANTIFIER_BRACE = re.compile(r"\{\d*(?:,\d*)?\}")
+
+def _literal_brace(pattern: str) -> bool:
+    i, in_class = 0, False
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            i += 2
+            continue
+        if in_class:
+            in_class = c != "]"
+        elif c == "[":
+            in_class = True
+            # a leading "]" (or "^]") is a literal member
+            i += 1
+            if pattern.startswith("^", i):
+                i += 1
+            if pattern.startswith("]", i):
+                i += 1
+            continue
+        elif c == "{" and not _QUANTIFIER_BRACE.match(pattern, i):
+            return True
+        i += 1
+    return False
+
+def _engines_agree(pattern: str) -> bool:
+    # False where `regex` (VERSION0) may read the pattern differently from
+    # re: POSIX classes and set operations inside [] (re warns about those
+    # with FutureWarning and treats them as plain members) and literal "{".
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", FutureWarning)
+        try:
+            # the parser, not re.compile: its cache would swallow the warning
+            sre_parse.parse(pattern, _FLAGS)
+        except (FutureWarning, re.error):
+            return False
+    return not _literal_brace(pattern)
+
+def compile_guarded(pattern: str) -> Optional[GuardedPattern]:
+    if not pattern:
+        return None
+    try:
+        return GuardedPattern(re.compile(pattern, _FLAGS))
+    except re.error:
+        return None
+
+# --- static lint ---
+
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+_POSSESSIVE = getattr(sre_constants, "POSSESSIVE_REPEAT", None)
+_ATOMIC = getattr(sre_constants, "ATOMIC_GROUP", None)
+
+# Approximate character sets: ASCII code points, plus _OTHER for "some
+# character beyond ASCII".
+CharSet = FrozenSet[int]
+
+_OTHER = -1
+_ALL: CharSet = frozenset(range(128)) | {_OTHER}
+_DIGITS = frozenset(range(48, 58))
+_SPACES = frozenset([9, 10, 11, 12, 13, 28, 29, 30, 31, 32])
+_WORD = _DIGITS | frozenset(range(65, 91)) | frozenset(range(97, 123)) | {95}
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: _DIGITS | {_OTHER},
+    sre_constants.CATEGORY_NOT_DIGIT: _ALL - _DIGITS,
+    sre_constants.CATEGORY_SPACE: _SPACES | {_OTHER},
+    sre_constants.CATEGORY_NOT_SPACE: _ALL - _SPACES,
+    sre_constants.CATEGORY_WORD: _WORD | {_OTHER},
+    sre_constants.CATEGORY_NOT_WORD: _ALL - _WORD,
+}
+
+def _fold(cp: int) -> CharSet:
+    # both cases: template regexes are case-insensitive
+    if cp >= 128:
+        return frozenset([_OTHER])
+    ch = chr(cp)
+    return frozenset([ord(ch.lower()), ord(ch.upper())])
+
+def _class_chars(items) -> CharSet:
+    out = set()
+    negate = False
+    for op, av in items:
+        if op is sre_constants.NEGATE:
+            negate = True
+        elif op is sre_constants.LITERAL:
+            out |= _fold(av)
+        elif op is sre_constants.RANGE:
+            lo, hi = av
+            for cp in range(lo, min(hi, 127) + 1):
+                out |= _fold(cp)
+            if hi >= 128:
+                out.add(_OTHER)
+        elif op is sre_constants.CATEGORY:
+            out |= _CATEGORIES.get(av, _ALL)
+        else:
+            out |= _ALL
+    if negate:
+        # a negated class still matches other non-ASCII characters
+        return (_ALL - out) | {_OTHER}
+    return frozenset(out)
+
+def _first(items) -> "tuple[CharSet, bool]":
+    # (characters a match of the sequence can start with, can it be empty)
+    first: set = set()
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            return frozenset(first | _fold(av)), False
+        if op is sre_constants.NOT_LITERAL:
+            return frozenset(first | (_ALL - _fold(av)) | {_OTHER}), False
+        if op is sre_constants.ANY:
+            return _ALL, False
+        if op is sre_constants.IN:
+            return frozenset(first | _class_chars(av)), False
+        if op in _REPEATS or op is _POSSESSIVE:
+            lo, _hi, sub = av
+            f, empty = _first(sub)
+            first |= f
+            if lo and not empty:
+                return frozenset(first), False
+        elif op is sre_constants.SUBPATTERN or op is _ATOMIC:
+            f, empty = _first(av[-1] if op is sre_constants.SUBPATTERN else av)
+            first |= f
+            if not empty:
+                return frozenset(first), False
+        elif op is sre_constants.BRANCH:
+            alts = [_first(alt) for alt in av[1]]
+            for f, _empty in alts:
+                first |= f
+            if not any(empty for _f, empty in alts):
+                return frozenset(first), False
+        elif op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            continue
+        else:
+            # backreferences, conditionals: anything
+            return _ALL, False
+    return frozenset(first), True
+
+def _alternatives_overlap(alts, after: CharSet) -> bool:
+    # Two alternatives that can start with the same character, or both
+    # match nothing, e.g. (a|aa)+ (re parses it as a(|a)) or (a|a)*.
+    seen: set = set()
+    seen_empty = False
+    for f, empty in alts:
+        chars = (f | after) if empty else f
+        if (empty and seen_empty) or chars & seen:
+            return True
+        seen |= chars
+        seen_empty = seen_empty or empty
+    return False
+
+def _ambiguous(items, follow: CharSet, in_loop: bool) -> bool:
+    # Walks the sequence right to left, tracking what can follow each item.
+    # Inside a repeat that can run more than once, a variable-length repeat
+    # whose characters overlap what follows it can split a run of text in
+    # exponentially many ways, e.g. (.+)+ or (\w+\s?)*. (\d+[.,])+ is fine:
+    # every digit run ends at the separator. Likewise for alternatives that
+    # overlap, e.g. (a|aa)+ or (a|a)*.
+    after = follow
+    for op, av in reversed(items):
+        if op in _REPEATS:
+            lo, hi, sub = av
+            f, empty = _first(sub)
+            if in_loop and hi != lo and f & after:
+                return True
+            loops = hi > 1
+            if _ambiguous(sub, (f | after) if loops else after, in_loop or loops):
+                return True
+            after = (f | after) if (lo == 0 or empty) else f
+        elif op is sre_constants.SUBPATTERN:
+            if _ambiguous(av[-1], after, in_loop):
+                return True
+            f, empty = _first(av[-1])
+            after = (f | after) if empty else f
+        elif op is sre_constants.BRANCH:
+            if in_loop and _alternatives_overlap([_first(alt) for alt in av[1]], after):
+                return True
+            if any(_ambiguous(alt, after, in_loop) for alt in av[1]):
+                return True
+            f, empty = _first([(op, av)])
+            after = (f | after) if empty else f
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            if _ambiguous(av[1], _ALL, False):
+                return True
+        elif op is sre_constants.AT:
+            continue
+        else:
+            # atomic groups and possessive repeats don't backtrack into
+            # their contents
+            f, empty = _first([(op, av)])
+            after = (f | after) if empty else f
+    return False
+
+def lint_pattern(pattern: str) -> Optional[str]:
+    # Problem with a template regex, or None if it looks fine.
+    if not pattern:
+        return None
+    try:
+        re.compile(pattern, _FLAGS)
+        parsed = sre_parse.parse(pattern, _FLAGS)
+    except re.error as e:
+        return f"invalid regex ({e})"
+    if not _engines_agree(pattern):
+        return "ambiguous syntax: escape a literal [ inside [...] and every literal { as \\[ and \\{"
+    if _ambiguous(parsed, frozenset(), False):
+        return (
+            "a repeated group can match the same text in more than one way, e.g. (.+)+, (\\w+\\s?)* or (a|aa)+;"
+            " this can take exponential time on text that almost matches"
+        )
+    return None
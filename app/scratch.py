@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import fcntl
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, Set, Union
+
+from .settings import settings
+
+# Keeps directory names apart for processes with the same pid (in a
+# container the app is usually pid 1 on every start).
+_TOKEN = uuid.uuid4().hex[:8]
+
+# pdf2image output and upload temp files written straight into ODM_TMP_DIR
+# by older versions.
+_LEGACY_TMP_FILE = re.compile(r"^([0-9a-f-]{36}-\d+\.(png|ppm|jpg)|upload_.*)$")
+
+_lock = threading.Condition()
+_reserved = 0
+_active: Set[str] = set()
+
+def root_dir() -> str:
+    return os.path.abspath(settings.scratch_dir or os.path.join(settings.tmp_dir, "scratch"))
+
+def quota_bytes() -> int:
+    return max(0, int(settings.scratch_quota_mb or 0)) * 1024 * 1024
+
+# Each job directory holds this file flock()ed for as long as the job runs.
+# The scratch dir may live on a volume shared by several hosts, where the pid
+# in a directory name says nothing; the lock does.
+_LOCK_NAME = ".lock"
+
+# A directory without a lock file is only swept once it is this old: it may
+# be one that another process has just created.
+_UNLOCKED_GRACE_SECONDS = 300
+
+@contextmanager
+def job_dir(kind: str = "job") -> Iterator[str]:
+    # Per-job directory, removed when the job finishes or fails. Directories
+    # of crashed processes are removed by sweep() on the next start.
+    path = os.path.join(root_dir(), f"{os.getpid()}-{_TOKEN}-{kind}-{uuid.uuid4().hex[:12]}")
+    os.makedirs(path, exist_ok=True)
+    fd = os.open(os.path.join(path, _LOCK_NAME), os.O_CREAT | os.O_RDWR, 0o644)
+    with _lock:
+        _active.add(path)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield path
+    finally:
+        with _lock:
+            _active.discard(path)
+        # closed first: an open file keeps NFS from removing the directory
+        os.close(fd)
+        shutil.rmtree(path, ignore_errors=True)
+
+def _stale(path: str) -> bool:
+    try:
+        fd = os.open(os.path.join(path, _LOCK_NAME), os.O_RDWR)
+    except FileNotFoundError:
+        try:
+            return time.time() - os.stat(path).st_mtime > _UNLOCKED_GRACE_SECONDS
+        except OSError:
+            return False
+    except OSError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        # held by a running job, in this process or on any host
+        return False
+    finally:
+        os.close(fd)
+    return True
+
+@contextmanager
+def reserve(nbytes: int, timeout: float = 600.0) -> Iterator[None]:
+    # Backpressure: block until `nbytes` fit under the quota. A reservation
+    # larger than the whole quota is let through when nothing else is
+    # reserved, so a single huge job can't wait forever.
+    global _reserved
+    nbytes = max(0, int(nbytes))
+    quota = quota_bytes()
+    deadline = time.monotonic() + timeout
+    with _lock:
+        while quota and _reserved and _reserved + nbytes > quota:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RuntimeError("Scratch space quota exhausted")
+            _lock.wait(remaining)
+        _reserved += nbytes
+    try:
+        yield
+    finally:
+        with _lock:
+            _reserved -= nbytes
+            _lock.notify_all()
+
+def sweep() -> int:
+    removed = 0
+    root = root_dir()
+    os.makedirs(root, exist_ok=True)
+    for entry in os.scandir(root):
+        if not entry.is_dir(follow_symlinks=False):
+            continue
+        with _lock:
+            if entry.path in _active:
+                continue
+        if not _stale(entry.path):
+            continue
+        shutil.rmtree(entry.path, ignore_errors=True)
+        removed += 1
+
+    tmp = os.path.abspath(settings.tmp_dir)
+    if os.path.isdir(tmp):
+        for entry in os.scandir(tmp):
+            if entry.is_file(follow_symlinks=False) and _LEGACY_TMP_FILE.match(entry.name):
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError:
+                    pass
+    return removed
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for r, _dirs, files in os.walk(path):
+        for fn in files:
+            try:
+                total += os.lstat(os.path.join(r, fn)).st_size
+            except OSError:
+                pass
+    return total
+
+def usage() -> Dict[str, Union[str, int]]:
+    with _lock:
+        reserved = _reserved
+        active = len(_active)
+    root = root_dir()
+    return {
+        "root": root,
+        "bytes": _dir_size(root) if os.path.isdir(root) else 0,
+        "reserved": reserved,
+        "quota": quota_bytes(),
+        "active_jobs": active,
+    }
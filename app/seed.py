@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from sqlmodel import select
+from . import template_registry
 from .db import get_session
 from .models import Template
 
@@ -32,3 +33,4 @@ def seed_defaults() -> None:
 
         s.add(tpl)
         s.commit()
+    template_registry.bump()
@@ -11,10 +11,52 @@ class Settings(BaseSettings):
     config_dir: str = Field(default="/data/config", alias="ODM_CONFIG_DIR")
     failed_dir: str = Field(default="/data/failed", alias="ODM_FAILED_DIR")
     tmp_dir: str = Field(default="/data/tmp", alias="ODM_TMP_DIR")
+    scratch_dir: str = Field(default="", alias="ODM_SCRATCH_DIR")
+    scratch_quota_mb: int = Field(default=1024, alias="ODM_SCRATCH_QUOTA_MB")
 
     scan_enabled: bool = Field(default=True, alias="ODM_SCAN_ENABLED")
     scan_interval_seconds: int = Field(default=15, alias="ODM_SCAN_INTERVAL_SECONDS")
+    ingest_workers: int = Field(default=2, alias="ODM_INGEST_WORKERS")
+    ingest_queue_size: int = Field(default=1000, alias="ODM_INGEST_QUEUE_SIZE")
+    ingest_debounce_seconds: float = Field(default=1.0, alias="ODM_INGEST_DEBOUNCE_SECONDS")
+    ingest_quiet_seconds: float = Field(default=2.0, alias="ODM_INGEST_QUIET_SECONDS")
+    ingest_reconcile_seconds: int = Field(default=300, alias="ODM_INGEST_RECONCILE_SECONDS")
+    ingest_dedupe_size: int = Field(default=10000, alias="ODM_INGEST_DEDUPE_SIZE")
+    ingest_dedupe_ttl_seconds: int = Field(default=86400, alias="ODM_INGEST_DEDUPE_TTL_SECONDS")
+    ingest_mode: str = Field(default="auto", alias="ODM_INGEST_MODE")
+    ingest_poll_seconds: float = Field(default=10.0, alias="ODM_INGEST_POLL_SECONDS")
+    job_lease_seconds: int = Field(default=60, alias="ODM_JOB_LEASE_SECONDS")
+    job_max_attempts: int = Field(default=3, alias="ODM_JOB_MAX_ATTEMPTS")
+    job_retry_base_seconds: int = Field(default=30, alias="ODM_JOB_RETRY_BASE_SECONDS")
+    job_poll_seconds: float = Field(default=2.0, alias="ODM_JOB_POLL_SECONDS")
+    job_drain_seconds: int = Field(default=10, alias="ODM_JOB_DRAIN_SECONDS")
+    interactive_workers: int = Field(default=1, alias="ODM_INTERACTIVE_WORKERS")
+    background_processing: bool = Field(default=True, alias="ODM_BACKGROUND_PROCESSING")
+    leader_poll_seconds: float = Field(default=5.0, alias="ODM_LEADER_POLL_SECONDS")
+    queue_sjf: str = Field(default="off", alias="ODM_QUEUE_SJF")
+    regex_timeout_ms: int = Field(default=1000, alias="ODM_REGEX_TIMEOUT_MS")
+
     tesseract_lang: str = Field(default="eng", alias="ODM_TESSERACT_LANG")
+    ocr_backend: str = Field(default="pytesseract", alias="ODM_OCR_BACKEND")
+    ocr_workers: int = Field(default=0, alias="ODM_OCR_WORKERS")
+    ocr_page_window: int = Field(default=8, alias="ODM_OCR_PAGE_WINDOW")
+    ocr_render_mode: str = Field(default="memory", alias="ODM_OCR_RENDER_MODE")
+    ocr_dpi: int = Field(default=200, alias="ODM_OCR_DPI")
+    ocr_adaptive_dpi: bool = Field(default=False, alias="ODM_OCR_ADAPTIVE_DPI")
+    ocr_adaptive_low_dpi: int = Field(default=150, alias="ODM_OCR_ADAPTIVE_LOW_DPI")
+    ocr_adaptive_high_dpi: int = Field(default=300, alias="ODM_OCR_ADAPTIVE_HIGH_DPI")
+    ocr_min_confidence: float = Field(default=70.0, alias="ODM_OCR_MIN_CONFIDENCE")
+    ocr_preprocess: str = Field(default="downscale,grayscale", alias="ODM_OCR_PREPROCESS")
+    ocr_target_dpi: int = Field(default=300, alias="ODM_OCR_TARGET_DPI")
+    ocr_progressive: bool = Field(default=False, alias="ODM_OCR_PROGRESSIVE")
+    ocr_progressive_pages: int = Field(default=1, alias="ODM_OCR_PROGRESSIVE_PAGES")
+    ocr_progressive_dpi: int = Field(default=0, alias="ODM_OCR_PROGRESSIVE_DPI")
+    ocr_page_timeout_seconds: float = Field(default=0, alias="ODM_OCR_PAGE_TIMEOUT_SECONDS")
+    ocr_job_timeout_seconds: float = Field(default=0, alias="ODM_OCR_JOB_TIMEOUT_SECONDS")
+    pdf_text_backend: str = Field(default="pdfminer", alias="ODM_PDF_TEXT_BACKEND")
+    pdf_probe_pages: int = Field(default=3, alias="ODM_PDF_PROBE_PAGES")
+    ocr_cache_enabled: bool = Field(default=True, alias="ODM_OCR_CACHE_ENABLED")
+    ocr_cache_max_mb: int = Field(default=256, alias="ODM_OCR_CACHE_MAX_MB")
 
     auth_enabled: bool = Field(default=True, alias="ODM_AUTH_ENABLED")
     admin_password: str = Field(default="", alias="ODM_ADMIN_PASSWORD")
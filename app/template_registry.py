@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from sqlmodel import select
+
+from .db import get_session
+from .matching import TemplateMatcher
+from .models import Template
+from .regex_guard import set_timeout_handler
+from .settings import settings
+from .templating import CompiledTemplate, compile_template
+
+# Enabled templates, compiled once and reused for every document until a
+# template changes. bump() invalidates this process's copy and touches
+# templates.version in the config dir so other processes (web workers,
+# `python -m app worker`) reload on their next lookup.
+
+_lock = threading.Lock()
+_version = 0
+_cache: Optional[Tuple[tuple, TemplateMatcher]] = None
+
+def _version_path() -> str:
+    return os.path.join(settings.config_dir, "templates.version")
+
+def _shared_version() -> tuple:
+    # Replaced atomically on each bump, so the inode changes even where
+    # mtimes are coarse.
+    try:
+        st = os.stat(_version_path())
+        return (st.st_ino, st.st_mtime_ns)
+    except OSError:
+        return ()
+
+def bump() -> None:
+    global _version
+    with _lock:
+        _version += 1
+    path = _version_path()
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            f.write(f"{time.time_ns()} {os.getpid()} {_version}\n")
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+def matcher() -> TemplateMatcher:
+    global _cache
+    key = (_version, _shared_version())
+    cache = _cache
+    if cache is not None and cache[0] == key:
+        return cache[1]
+    with _lock:
+        if _cache is not None and _cache[0] == key:
+            return _cache[1]
+        with get_session() as s:
+            templates = s.exec(
+                select(Template).where(Template.enabled == True).order_by(Template.id)  # noqa: E712
+            ).all()
+        m = TemplateMatcher([compile_template(tpl) for tpl in templates])
+        _cache = (key, m)
+        return m
+
+def _disable_pattern(pattern: str, elapsed: float) -> None:
+    # A search ran over ODM_REGEX_TIMEOUT_MS: disable the pattern wherever it
+    # is used, so the next document doesn't pay for it again.
+    message = f"Disabled after a search took {elapsed * 1000:.0f} ms (budget {settings.regex_timeout_ms} ms)"
+    with get_session() as s:
+        for tpl in s.exec(select(Template)).all():
+            hit = [(f, p) for f, p in tpl.regex_fields() if p == pattern and (f, p) not in tpl.disabled_patterns()]
+            for f, p in hit:
+                tpl.add_warning(f, p, message)
+            if hit:
+                s.add(tpl)
+        s.commit()
+    bump()
+
+set_timeout_handler(_disable_pattern)
+
+def enabled_templates() -> List[CompiledTemplate]:
+    return matcher().templates
+
+def choose(text: str) -> Optional[CompiledTemplate]:
+    # Best-scoring matching template; on a tie the later one wins.
+    return matcher().choose(text)
@@ -4,11 +4,12 @@ import os
 import re
 from dataclasses import dataclass
 from datetime import datetime, date
-from typing import Tuple, Optional, Dict, Any
+from typing import Tuple, Optional, Dict, Any, List, Union
 
 from dateutil import parser as dateparser
 
 from .models import Template
+from .regex_guard import GuardedPattern, compile_guarded
 from .utils import safe_filename
 
 @dataclass
@@ -19,36 +20,84 @@ class Extracted:
     doc_type: str = "Document"
     doc_folder: str = "Inbox"
 
-def evaluate_template(tpl: Template, text: str) -> Tuple[bool, int]:
-    pats = tpl.match_patterns()
-    if not pats:
+# "{var}" / "{var:fmt}" placeholders in output path and filename templates
+_PLACEHOLDER = re.compile(r"\{([a-zA-Z_]+)(?::([^}]+))?\}")
+
+# Parsed format string: literal text, then an optional (key, fmt) placeholder
+FormatParts = Tuple[Tuple[str, Optional[str], Optional[str]], ...]
+
+def _compile(regex: str, field: str, disabled: set) -> Optional[GuardedPattern]:
+    # patterns the regex guard disabled compile to None, like invalid ones
+    if (field, regex) in disabled:
+        return None
+    return compile_guarded(regex)
+
+def parse_format(t: str) -> FormatParts:
+    parts: List[Tuple[str, Optional[str], Optional[str]]] = []
+    pos = 0
+    for m in _PLACEHOLDER.finditer(t):
+        parts.append((t[pos:m.start()], m.group(1), m.group(2)))
+        pos = m.end()
+    parts.append((t[pos:], None, None))
+    return tuple(parts)
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    # A Template with its regexes compiled and formats parsed once, as held
+    # by app/template_registry.py. Invalid and disabled regexes compile to
+    # None.
+    template: Template
+    id: Optional[int]
+    name: str
+    match_mode: str
+    patterns: Tuple[Optional[GuardedPattern], ...]
+    company: Optional[GuardedPattern]
+    invoice_number: Optional[GuardedPattern]
+    date: Optional[GuardedPattern]
+    output_path: FormatParts
+    filename: FormatParts
+
+def compile_template(tpl: Template) -> CompiledTemplate:
+    disabled = tpl.disabled_patterns()
+    return CompiledTemplate(
+        template=tpl,
+        id=tpl.id,
+        name=tpl.name,
+        match_mode=tpl.match_mode,
+        patterns=tuple(_compile(p, "match", disabled) for p in tpl.match_patterns()),
+        company=_compile(tpl.company_regex, "company_regex", disabled),
+        invoice_number=_compile(tpl.invoice_number_regex, "invoice_number_regex", disabled),
+        date=_compile(tpl.date_regex, "date_regex", disabled),
+        output_path=parse_format(tpl.output_path_template or "{doc_folder}"),
+        filename=parse_format(tpl.filename_template or "{original_name}"),
+    )
+
+def _compiled(tpl: Union[Template, CompiledTemplate]) -> CompiledTemplate:
+    return tpl if isinstance(tpl, CompiledTemplate) else compile_template(tpl)
+
+def evaluate_template(tpl: Union[Template, CompiledTemplate], text: str) -> Tuple[bool, int]:
+    ct = _compiled(tpl)
+    if not ct.patterns:
         return False, 0
-    flags = re.IGNORECASE | re.MULTILINE
     hits = 0
-    for p in pats:
-        try:
-            if re.search(p, text, flags=flags):
-                hits += 1
-        except re.error:
-            # ignore invalid regex in score
-            pass
-
-    if tpl.match_mode == "any":
+    for p in ct.patterns:
+        # an invalid or disabled regex (None) never hits
+        if p is not None and p.search(text):
+            hits += 1
+
+    if ct.match_mode == "any":
         return (hits > 0), hits
-    return (hits == len(pats)), hits
+    return (hits == len(ct.patterns)), hits
 
-def _first_group(regex: str, text: str) -> str:
-    if not regex:
+def _first_group(regex: Optional[GuardedPattern], text: str) -> str:
+    if regex is None:
         return ""
-    try:
-        m = re.search(regex, text, flags=re.IGNORECASE | re.MULTILINE)
-        if not m:
-            return ""
-        if m.groups():
-            return (m.group(1) or "").strip()
-        return (m.group(0) or "").strip()
-    except re.error:
+    m = regex.search(text)
+    if not m:
         return ""
+    if m.groups():
+        return (m.group(1) or "").strip()
+    return (m.group(0) or "").strip()
 
 def _parse_date(s: str) -> Optional[date]:
     s = (s or "").strip()
@@ -63,16 +112,17 @@ def _parse_date(s: str) -> Optional[date]:
     except Exception:
         return None
 
-def extract_fields(tpl: Template, text: str) -> Extracted:
-    company = _first_group(tpl.company_regex, text)
-    inv = _first_group(tpl.invoice_number_regex, text)
-    d = _parse_date(_first_group(tpl.date_regex, text))
+def extract_fields(tpl: Union[Template, CompiledTemplate], text: str) -> Extracted:
+    ct = _compiled(tpl)
+    company = _first_group(ct.company, text)
+    inv = _first_group(ct.invoice_number, text)
+    d = _parse_date(_first_group(ct.date, text))
     return Extracted(
         company=company,
         invoice_number=inv,
         date=d,
-        doc_type=tpl.doc_type or "Document",
-        doc_folder=tpl.doc_folder or "Inbox",
+        doc_type=ct.template.doc_type or "Document",
+        doc_folder=ct.template.doc_folder or "Inbox",
     )
 
 def _fmt_date(dt: Optional[date], fmt: str) -> str:
@@ -80,22 +130,23 @@ def _fmt_date(dt: Optional[date], fmt: str) -> str:
         return ""
     return datetime(dt.year, dt.month, dt.day).strftime(fmt)
 
-def _format_with_date_vars(t: str, vars: Dict[str, Any]) -> str:
+def _format_with_date_vars(parts: FormatParts, vars: Dict[str, Any]) -> str:
     # supports {date:%Y-%m-%d}
-    def repl(m: re.Match) -> str:
-        key = m.group(1)
-        fmt = m.group(2)
+    out: List[str] = []
+    for literal, key, fmt in parts:
+        out.append(literal)
+        if key is None:
+            continue
         if key == "date":
-            return _fmt_date(vars.get("date"), fmt or "%Y-%m-%d")
+            out.append(_fmt_date(vars.get("date"), fmt or "%Y-%m-%d"))
+            continue
         # fallback
         val = vars.get(key, "")
-        return str(val) if val is not None else ""
-    # {var:%Y} or {var}
-    pattern = re.compile(r"\{([a-zA-Z_]+)(?::([^}]+))?\}")
-    return pattern.sub(repl, t)
+        out.append(str(val) if val is not None else "")
+    return "".join(out)
 
 def format_path_and_name(
-    tpl: Template,
+    tpl: Union[Template, CompiledTemplate],
     extracted: Extracted,
     original_stem: str,
     ext: str
@@ -109,8 +160,9 @@ def format_path_and_name(
         "original_name": original_stem,
     }
 
-    out_path = _format_with_date_vars(tpl.output_path_template or "{doc_folder}", vars)
-    out_name = _format_with_date_vars(tpl.filename_template or "{original_name}", vars)
+    ct = _compiled(tpl)
+    out_path = _format_with_date_vars(ct.output_path, vars)
+    out_name = _format_with_date_vars(ct.filename, vars)
 
     # sanitize parts
     out_path = out_path.strip().strip("/").strip()
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from typing import List, Optional
+
+from .settings import settings
+
+# `python -m app worker`: processes that lease jobs from the shared queue
+# and run them, next to (or instead of) the web process's own runner.
+
+_RESTART_DELAY_SECONDS = 5
+
+def _child(threads: int, interactive_threads: int) -> None:
+    from .jobqueue import Runner
+    from .ocr import shutdown_pool
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    runner = Runner(threads=threads, interactive_threads=interactive_threads, name="papertrellis-worker")
+    runner.start()
+    try:
+        stop.wait()
+    finally:
+        runner.stop()
+        shutdown_pool()
+
+def run(processes: int = 1, threads: Optional[int] = None, interactive_threads: Optional[int] = None) -> None:
+    from .db import init_db
+    from .leader import file_lock
+    from . import scratch
+
+    for d in (settings.config_dir, settings.ingest_dir, settings.library_dir, settings.failed_dir, settings.tmp_dir):
+        os.makedirs(d, exist_ok=True)
+    scratch.sweep()
+    with file_lock("schema"):
+        init_db()
+
+    threads = settings.ingest_workers if threads is None else threads
+    interactive_threads = settings.interactive_workers if interactive_threads is None else interactive_threads
+    ctx = multiprocessing.get_context("spawn")
+
+    def _spawn(i: int):
+        p = ctx.Process(target=_child, args=(threads, interactive_threads), name=f"papertrellis-worker-{i + 1}")
+        p.start()
+        return p
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+
+    procs: List = [_spawn(i) for i in range(max(1, int(processes)))]
+    died_at = [0.0] * len(procs)
+    while not stopping.wait(1.0):
+        # a crashed worker's jobs are reclaimed by the others once their
+        # leases expire; restart it after a short pause
+        for i, p in enumerate(procs):
+            if p.is_alive():
+                continue
+            if not died_at[i]:
+                died_at[i] = time.monotonic()
+            elif time.monotonic() - died_at[i] >= _RESTART_DELAY_SECONDS:
+                procs[i] = _spawn(i)
+                died_at[i] = 0.0
+
+    for p in procs:
+        if p.is_alive():
+            p.terminate()
+    end = time.monotonic() + settings.job_drain_seconds + 5
+    for p in procs:
+        p.join(timeout=max(0.0, end - time.monotonic()))
+        if p.is_alive():
+            p.kill()
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import heapq
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+class WorkQueue:
+    # Bounded queue of file paths drained by a pool of worker threads.
+    #
+    # Events for a path that is already queued are coalesced into the one
+    # item, and each new event pushes its due time back by `debounce`
+    # seconds. Paths currently being processed are not queued again. When the
+    # queue is full, put() blocks the producer (backpressure).
+    #
+    # If `settle` is given, it is called for a due path that was not put()
+    # with settled=True; it returns None when the path is ready, or the number
+    # of seconds after which to check again. Nothing sleeps per path: workers
+    # only wait for the earliest due item.
+
+    def __init__(
+        self,
+        handler: Callable[[str], None],
+        workers: int = 1,
+        maxsize: int = 1000,
+        debounce: float = 1.0,
+        name: str = "papertrellis-worker",
+        settle: Optional[Callable[[str], Optional[float]]] = None,
+    ) -> None:
+        self._handler = handler
+        self._settle = settle
+        self.workers = max(1, int(workers))
+        self.maxsize = max(1, int(maxsize))
+        self.debounce = max(0.0, float(debounce))
+        self._name = name
+
+        self._cond = threading.Condition()
+        self._due: Dict[str, float] = {}  # queued path -> monotonic due time
+        self._heap: List[Tuple[float, str]] = []  # may hold stale entries
+        self._in_flight: Dict[str, float] = {}  # path -> monotonic start
+        self._settled: Set[str] = set()
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+
+    def put(
+        self,
+        path: str,
+        delay: Optional[float] = None,
+        block: bool = True,
+        timeout: Optional[float] = None,
+        settled: bool = False,
+    ) -> bool:
+        path = os.path.abspath(path)
+        due = time.monotonic() + (self.debounce if delay is None else max(0.0, delay))
+        with self._cond:
+            if self._stopping or path in self._in_flight:
+                return False
+            if path not in self._due:
+                end = None if timeout is None else time.monotonic() + timeout
+                while len(self._due) >= self.maxsize:
+                    remaining = None if end is None else end - time.monotonic()
+                    if not block or (remaining is not None and remaining <= 0):
+                        return False
+                    self._cond.wait(remaining)
+                    if self._stopping or path in self._in_flight:
+                        return False
+            if settled:
+                self._settled.add(path)
+            else:
+                # a new write invalidates an earlier close
+                self._settled.discard(path)
+            self._due[path] = due
+            heapq.heappush(self._heap, (due, path))
+            self._cond.notify_all()
+            return True
+
+    def _requeue(self, path: str, delay: float) -> None:
+        # Back into the queue without waiting for capacity: the path's own
+        # slot was only just released.
+        with self._cond:
+            self._in_flight.pop(path, None)
+            if self._stopping or path in self._due:
+                return
+            due = time.monotonic() + max(0.0, delay)
+            self._due[path] = due
+            heapq.heappush(self._heap, (due, path))
+            self._cond.notify_all()
+
+    def contains(self, path: str) -> bool:
+        path = os.path.abspath(path)
+        with self._cond:
+            return path in self._due or path in self._in_flight
+
+    def _next(self) -> Optional[Tuple[str, bool]]:
+        with self._cond:
+            while not self._stopping:
+                while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, path = self._heap[0]
+                now = time.monotonic()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+                heapq.heappop(self._heap)
+                del self._due[path]
+                self._in_flight[path] = now
+                settled = path in self._settled
+                self._settled.discard(path)
+                # a slot is free for blocked producers
+                self._cond.notify_all()
+                return path, settled
+            return None
+
+    def _run(self) -> None:
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            path, settled = item
+            if not settled and self._settle:
+                try:
+                    delay = self._settle(path)
+                except Exception:
+                    delay = None
+                if delay is not None:
+                    self._requeue(path, delay)
+                    continue
+            try:
+                self._handler(path)
+            except Exception:
+                pass
+            finally:
+                with self._cond:
+                    self._in_flight.pop(path, None)
+                    self._cond.notify_all()
+
+    def start(self) -> None:
+        with self._cond:
+            self._stopping = False
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, daemon=True, name=f"{self._name}-{i + 1}")
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        end = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(timeout=max(0.0, end - time.monotonic()))
+        self._threads = []
+
+    def stats(self) -> Dict[str, object]:
+        now = time.monotonic()
+        with self._cond:
+            in_flight = sorted(self._in_flight.items(), key=lambda kv: kv[1])
+            return {
+                "depth": len(self._due),
+                "maxsize": self.maxsize,
+                "workers": self.workers,
+                "in_flight": [{"path": p, "seconds": round(now - started, 1)} for p, started in in_flight],
+            }
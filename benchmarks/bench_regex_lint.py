@@ -0,0 +1,81 @@
+"""Template regex lint: catastrophic patterns are rejected, common ones pass.
+
+Run from the repository root:
+
+    python benchmarks/bench_regex_lint.py
+    python benchmarks/bench_regex_lint.py --sizes 12,16,20,24
+
+Every pattern below must get the verdict listed for it from lint_pattern().
+For the rejected ones, plain `re` is then timed on text that almost matches,
+so the growth the lint guards against is visible.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.regex_guard import lint_pattern  # noqa: E402
+
+# (pattern, text that almost matches as a function of n); all rejected
+REJECTED = [
+    (r"(a|aa)+b", lambda n: "a" * n),
+    (r"(a|a)*b", lambda n: "a" * n),
+    (r"(a|b+)*c", lambda n: "b" * n),
+    (r"(x|x?)+y", lambda n: "x" * n),
+    (r"(.+)+:", lambda n: "x" * n),
+    (r"(\w+\s?)*$", lambda n: "word " * (n // 5) + "!"),
+]
+
+ACCEPTED = [
+    r"(\d+[.,])+",
+    r"([A-Z][a-z]+ )+",
+    r"(ab|ac)+",
+    r"(foo|bar)+",
+    r"(a?b)*c",
+    r"(?:\w|-)+",
+    r"(?:[a-z]+\.)+[a-z]{2,}",
+    r"\d{1,3}(?:[., ]\d{3})*(?:,\d{2})?",
+    r"invoice\s*(no|number)\s*[:#]?",
+    r"\bVendor0001 (GmbH|B\.V\.|Ltd)\b",
+    r"Rechnung(?:s-?nr|nummer)",
+    r"[^\n]+",
+]
+
+def timed(pattern: re.Pattern, text: str) -> float:
+    start = time.perf_counter()
+    pattern.search(text)
+    return (time.perf_counter() - start) * 1000
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sizes", default="12,16,20")
+    args = ap.parse_args()
+    sizes = [int(x) for x in args.sizes.split(",")]
+
+    failed = 0
+    for pattern, _text in REJECTED:
+        if not lint_pattern(pattern):
+            print(f"NOT REJECTED {pattern}", file=sys.stderr)
+            failed += 1
+    for pattern in ACCEPTED:
+        msg = lint_pattern(pattern)
+        if msg:
+            print(f"REJECTED {pattern}: {msg}", file=sys.stderr)
+            failed += 1
+    if failed:
+        return 1
+    print(f"{len(REJECTED)} rejected, {len(ACCEPTED)} accepted as expected\n")
+
+    print(f"{'pattern':<14}" + "".join(f"{f'n={n} ms':>12}" for n in sizes))
+    for pattern, text in REJECTED:
+        compiled = re.compile(pattern, re.IGNORECASE | re.MULTILINE)
+        print(f"{pattern:<14}" + "".join(f"{timed(compiled, text(n)):>12.1f}" for n in sizes))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
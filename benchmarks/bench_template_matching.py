@@ -0,0 +1,98 @@
+"""Template matching: one regex search per pattern vs the literal prefilter.
+
+Run from the repository root:
+
+    python benchmarks/bench_template_matching.py
+    python benchmarks/bench_template_matching.py --templates 50,200,800 --text-kb 200
+
+Synthetic per-vendor templates are matched against synthetic OCR text. The
+two engines must choose the same template, and the timings show how each
+scales with the number of templates and the text size.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.matching import TemplateMatcher  # noqa: E402
+from app.models import Template  # noqa: E402
+from app.templating import compile_template, evaluate_template  # noqa: E402
+
+_WORDS = (
+    "total amount due payment terms bank account reference customer order delivery "
+    "quantity price description tax net gross page date number address street city"
+).split()
+
+def make_templates(n: int):
+    out = []
+    for i in range(n):
+        tpl = Template(name=f"Vendor {i}", match_mode="all" if i % 3 else "any")
+        tpl.set_match_patterns([
+            rf"\bVendor{i:04d} (GmbH|B\.V\.|Ltd)\b",
+            r"invoice\s*(no|number)\s*[:#]?",
+            rf"customer\s+id\s*:\s*C{i:04d}",
+        ])
+        tpl.company_regex = rf"(Vendor{i:04d} \w+)"
+        out.append(compile_template(tpl))
+    return out
+
+def make_text(kb: int, vendor: int, rng: random.Random) -> str:
+    words = []
+    size = 0
+    while size < kb * 1024:
+        w = rng.choice(_WORDS)
+        words.append(w)
+        size += len(w) + 1
+    header = f"Vendor{vendor:04d} GmbH\nInvoice number: 12345\nCustomer ID: C{vendor:04d}\n"
+    mid = len(words) // 2
+    return " ".join(words[:mid]) + "\n" + header + " ".join(words[mid:])
+
+def naive_choose(templates, text):
+    best = None
+    best_score = -1
+    for ct in templates:
+        ok, score = evaluate_template(ct, text)
+        if ok and score >= best_score:
+            best = ct
+            best_score = score
+    return best
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--templates", default="10,50,100,200,500")
+    ap.add_argument("--text-kb", default="20,200")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'templates':>9} {'text KB':>8} {'per-pattern ms':>15} {'prefilter ms':>13} {'speedup':>8}")
+    for n in [int(x) for x in args.templates.split(",")]:
+        templates = make_templates(n)
+        matcher = TemplateMatcher(templates)
+        for kb in [int(x) for x in args.text_kb.split(",")]:
+            text = make_text(kb, rng.randrange(n), rng)
+            expected = naive_choose(templates, text)
+            if matcher.choose(text) is not expected:
+                print(f"MISMATCH with {n} templates, {kb} KB", file=sys.stderr)
+                return 1
+            naive_ms = timed(lambda: naive_choose(templates, text), args.repeat)
+            fast_ms = timed(lambda: matcher.choose(text), args.repeat)
+            print(f"{n:>9} {kb:>8} {naive_ms:>15.1f} {fast_ms:>13.1f} {naive_ms / fast_ms:>7.1f}x")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())